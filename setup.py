@@ -31,6 +31,10 @@ setup(
         'Flask-Mako',
         'lxml',
     ],
+    extras_require={
+        # event-loop server, bin/flask-ctl serve evented
+        'evented': ['gevent'],
+    },
     entry_points={
         "console_scripts": [
             "flask-ctl = presence_analyzer.script:run",
@@ -2,5 +2,12 @@
 """
 Presence analyzer.
 """
+import time
+
+_IMPORT_STARTED = time.time()
+
 from .main import app
 from . import views
+from .startup import TIMINGS
+
+TIMINGS['import'] = time.time() - _IMPORT_STARTED
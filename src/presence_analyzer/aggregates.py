@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Company-wide aggregates computed in a single pass over the dataset.
+"""
+
+from main import app
+from sketches import Histogram
+from utils import get_data, memoize_per_version, seconds_since_midnight
+
+
+@memoize_per_version
+def get_company_statistics():
+    """
+    Aggregates presence of all users in one pass over the dataset.
+
+    It creates structure like this:
+    data = {
+        'weekdays': [
+            {'total': 78217, 'days': 3},
+            ...
+        ],
+        'headcount': {
+            datetime.date(2013, 9, 10): 3,
+            ...
+        },
+        'arrivals': <Histogram width=900 total=18>,
+    }
+    """
+    weekdays = [{'total': 0, 'days': 0} for _ in range(7)]
+    headcount = {}
+    arrivals = Histogram(app.config.get('ARRIVAL_BUCKET_SECONDS', 900))
+    for items in get_data().itervalues():
+        for date, item in items.iteritems():
+            start = seconds_since_midnight(item['start'])
+            end = seconds_since_midnight(item['end'])
+            weekday = weekdays[date.weekday()]
+            weekday['total'] += end - start
+            weekday['days'] += 1
+            headcount[date] = headcount.get(date, 0) + 1
+            arrivals.add(start)
+    return {
+        'weekdays': weekdays,
+        'headcount': headcount,
+        'arrivals': arrivals,
+    }
+
+
+def arrival_curve(arrivals):
+    """
+    Returns cumulative fraction of arrivals by the end of each bucket
+    as a list of (bucket start, fraction) pairs.
+    """
+    if not arrivals.total:
+        return []
+    result = []
+    seen = 0
+    for start, count in arrivals.buckets():
+        seen += count
+        result.append((start, float(seen) / arrivals.total))
+    return result
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Detection of suspicious presence records.
+"""
+
+from main import app
+from utils import get_data, memoize_per_version, seconds_since_midnight
+
+# scales MAD to standard deviation of normally distributed data
+MAD_SCALE = 1.4826
+
+
+def median(items):
+    """
+    Calculates median. Returns zero for empty lists.
+    """
+    ordered = sorted(items)
+    size = len(ordered)
+    if not size:
+        return 0
+    middle = size // 2
+    if size % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+def weekday_statistics(items):
+    """
+    Returns median and median absolute deviation of start times
+    (in seconds since midnight) for every weekday.
+
+    It creates a structure like this:
+    result = [
+        {'median': 32400, 'mad': 600},
+        ...
+    ]
+    """
+    starts = [[] for _ in range(7)]
+    for date, item in items.iteritems():
+        starts[date.weekday()].append(seconds_since_midnight(item['start']))
+    result = []
+    for values in starts:
+        center = median(values)
+        result.append({
+            'median': center,
+            'mad': median([abs(value - center) for value in values]),
+        })
+    return result
+
+
+def detect(items, threshold=None, max_interval=None, min_mad=None):
+    """
+    Returns suspicious presence records of a single user sorted by date.
+
+    Records are flagged when end is before start ('negative_interval'),
+    user stayed longer than max_interval seconds ('long_day'), or start
+    is more than threshold robust deviations away from the median start
+    on that weekday ('unusual_start'). Deviation is never smaller than
+    min_mad seconds, so very regular users are not flagged for minutes.
+    """
+    config = app.config
+    if threshold is None:
+        threshold = config.get('ANOMALY_THRESHOLD', 3.5)
+    if max_interval is None:
+        max_interval = config.get('ANOMALY_MAX_INTERVAL', 16 * 3600)
+    if min_mad is None:
+        min_mad = config.get('ANOMALY_MIN_MAD', 900)
+
+    statistics = weekday_statistics(items)
+    result = []
+    for date in sorted(items):
+        start = seconds_since_midnight(items[date]['start'])
+        end = seconds_since_midnight(items[date]['end'])
+        stats = statistics[date.weekday()]
+        reasons = []
+        if end < start:
+            reasons.append('negative_interval')
+        if end - start > max_interval:
+            reasons.append('long_day')
+        deviation = MAD_SCALE * max(stats['mad'], min_mad)
+        if abs(start - stats['median']) > threshold * deviation:
+            reasons.append('unusual_start')
+        if reasons:
+            result.append({
+                'date': date.isoformat(),
+                'start': start,
+                'end': end,
+                'reasons': reasons,
+            })
+    return result
+
+
+@memoize_per_version
+def get_anomalies():
+    """
+    Detects suspicious records of all users in one pass over the dataset.
+
+    It creates structure like this:
+    data = {
+        10: [
+            {
+                'date': '2013-09-10',
+                'start': 34745,
+                'end': 4792,
+                'reasons': ['negative_interval'],
+            },
+        ],
+    }
+    """
+    data = {}
+    for user_id, items in get_data().iteritems():
+        found = detect(items)
+        if found:
+            data[user_id] = found
+    return data
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of loaders, aggregations and endpoints.
+"""
+
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+from datetime import date, timedelta
+from xml.sax.saxutils import quoteattr, escape
+
+from main import app
+from utils import (
+    CACHE,
+    STORAGES,
+    cache_key,
+    get_data,
+    get_data_by_month,
+    get_xml,
+    group_by_weekday,
+    start_end_time,
+)
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+PERCENTILES = (50, 90, 99)
+
+USER_ENDPOINTS = (
+    '/api/v1/mean_time_weekday/{}',
+    '/api/v1/presence_weekday/{}',
+    '/api/v1/presence_start_end/{}',
+)
+
+
+def generate_dataset(directory, users=100, days=250, seed=0):
+    """
+    Writes synthetic data.csv and users.xml files to given directory.
+
+    Every user is present on about 90% of `days` working days, starting
+    around 9:00 and working around 8 hours, like in sample_data.csv.
+    Returns paths of both files and number of written rows.
+    """
+    rng = random.Random(seed)
+    csv_path = os.path.join(directory, 'data.csv')
+    xml_path = os.path.join(directory, 'users.xml')
+    user_ids = range(10, 10 + users)
+    rows = 0
+    with open(csv_path, 'w') as csvfile:
+        day = date(2011, 1, 3)
+        working_days = 0
+        while working_days < days:
+            if day.weekday() < 5:
+                working_days += 1
+                for user_id in user_ids:
+                    if rng.random() > 0.9:
+                        continue
+                    start = int(rng.gauss(9 * 3600, 1800))
+                    end = start + int(rng.gauss(8 * 3600, 3600))
+                    start = min(max(start, 0), 86399)
+                    end = min(max(end, start), 86399)
+                    csvfile.write('{},{},{},{}\n'.format(
+                        user_id,
+                        day.isoformat(),
+                        _format_seconds(start),
+                        _format_seconds(end),
+                    ))
+                    rows += 1
+            day += timedelta(days=1)
+
+    with open(xml_path, 'w') as xmlfile:
+        xmlfile.write(
+            '<?xml version="1.0" encoding="UTF-8" ?>\n'
+            '<intranet>\n'
+            '    <server>\n'
+            '        <host>intranet.stxnext.pl</host>\n'
+            '        <port>443</port>\n'
+            '        <protocol>https</protocol>\n'
+            '    </server>\n'
+            '    <users>\n'
+        )
+        for user_id in user_ids:
+            xmlfile.write(
+                '        <user id={}>\n'
+                '            <avatar>/api/images/users/{}</avatar>\n'
+                '            <name>{}</name>\n'
+                '        </user>\n'.format(
+                    quoteattr(str(user_id)),
+                    user_id,
+                    escape('User {}.'.format(user_id)),
+                )
+            )
+        xmlfile.write('    </users>\n</intranet>\n')
+    return csv_path, xml_path, rows
+
+
+def _format_seconds(seconds):
+    """
+    Formats seconds since midnight as HH:MM:SS.
+    """
+    return '{:02d}:{:02d}:{:02d}'.format(
+        seconds // 3600, seconds // 60 % 60, seconds % 60,
+    )
+
+
+def percentile(samples, percent):
+    """
+    Returns percentile of samples using nearest-rank method.
+    """
+    ordered = sorted(samples)
+    rank = max(int(round(percent / 100.0 * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+def peak_memory():
+    """
+    Returns peak resident memory of the process in kilobytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_isolated(func):
+    """
+    Calls func in a forked child process and returns its result, which
+    must be JSON serializable.
+
+    Peak memory of a forked child starts at its size at fork time, so
+    every benchmark reports only memory it allocated itself, and caches
+    it filled are dropped with the child.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        code = 0
+        try:
+            with os.fdopen(write_fd, 'w') as pipe:
+                json.dump(func(), pipe)
+        except Exception:  # pylint: disable=broad-except
+            log.exception('Benchmark failed')
+            code = 1
+        finally:
+            os._exit(code)  # pylint: disable=protected-access
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        output = pipe.read()
+    _, status = os.waitpid(pid, 0)
+    if status:
+        raise RuntimeError('Benchmark process failed')
+    return json.loads(output)
+
+
+def summarize(samples, items=1):
+    """
+    Returns timing statistics of samples in seconds.
+
+    Throughput is given in `items` processed per second of a sample.
+    """
+    total = sum(samples)
+    result = {
+        'runs': len(samples),
+        'mean': total / len(samples),
+        'throughput': items * len(samples) / total if total else None,
+    }
+    for percent in PERCENTILES:
+        result['p{}'.format(percent)] = percentile(samples, percent)
+    return result
+
+
+def summarize_isolated(collect, items=1):
+    """
+    Calls collect() in a forked child process and returns statistics
+    of samples it returned with increase of peak memory (in kilobytes)
+    during the call.
+    """
+    def run():
+        """
+        Collects samples and measures memory they took.
+        """
+        baseline = peak_memory()
+        samples = collect()
+        return dict(
+            summarize(samples, items),
+            peak_memory_increase_kb=peak_memory() - baseline,
+        )
+    return run_isolated(run)
+
+
+def measure(func, repeat, items=1, setup=None):
+    """
+    Calls func `repeat` times and returns timing statistics.
+
+    `setup` is called before every call and is not timed.
+    """
+    def collect():
+        """
+        Returns durations of the calls.
+        """
+        samples = []
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            started = time.time()
+            func()
+            samples.append(time.time() - started)
+        return samples
+    return summarize_isolated(collect, items)
+
+
+def measure_requests(client, urls, repeat):
+    """
+    Requests every url `repeat` times and returns per-request latency
+    statistics.
+    """
+    def collect():
+        """
+        Returns durations of the requests.
+        """
+        samples = []
+        for _ in range(repeat):
+            for url in urls:
+                started = time.time()
+                client.get(url)
+                samples.append(time.time() - started)
+        return samples
+    return summarize_isolated(collect)
+
+
+def _clear_cache(*names):
+    """
+    Drops given cache entries, or whole cache if none are given.
+    """
+    if not names:
+        CACHE.clear()
+    for name in names:
+        CACHE.pop(cache_key(name), None)
+
+
+def benchmark(csv_path, xml_path, repeat=5, endpoint_users=20):
+    """
+    Runs all benchmarks against given data files.
+
+    Loaders are timed cold. Derived structures and endpoints are timed
+    with raw data already loaded, so they measure only their own work.
+    Every benchmark runs in a forked process, see run_isolated().
+    App config is restored afterwards.
+    """
+    overrides = {
+        'DATA_CSV': csv_path,
+        'DATA_XML': xml_path,
+        'STORAGE': 'csv',
+    }
+    saved = {
+        key: app.config[key] for key in overrides if key in app.config
+    }
+    app.config.update(overrides)
+    STORAGES.clear()
+    _clear_cache()
+    try:
+        return _run_benchmarks(repeat, endpoint_users)
+    finally:
+        for key in overrides:
+            app.config.pop(key, None)
+        app.config.update(saved)
+        STORAGES.clear()
+        _clear_cache()
+
+
+def _run_benchmarks(repeat, endpoint_users):
+    """
+    Runs all benchmarks against data files set in app config.
+    """
+    rows = sum(len(items) for items in get_data().itervalues())
+    users = len(get_xml())
+    results = {}
+
+    results['get_data'] = measure(
+        get_data, repeat, items=rows, setup=_clear_cache,
+    )
+    results['get_xml'] = measure(
+        get_xml, repeat, items=users, setup=_clear_cache,
+    )
+    get_data()
+    get_xml()
+    results['get_data_by_month'] = measure(
+        get_data_by_month,
+        repeat,
+        items=rows,
+        setup=lambda: _clear_cache('get_data_by_month', 'get_rollup'),
+    )
+
+    data = get_data()
+    results['group_by_weekday'] = measure(
+        lambda: [group_by_weekday(items) for items in data.itervalues()],
+        repeat,
+        items=rows,
+    )
+    results['start_end_time'] = measure(
+        lambda: [start_end_time(items) for items in data.itervalues()],
+        repeat,
+        items=rows,
+    )
+
+    client = app.test_client()
+    user_ids = sorted(data)[:endpoint_users]
+    months = get_data_by_month()
+    urls = {
+        '/api/v1/years': ['/api/v1/years'],
+        '/api/v1/users': ['/api/v1/users'],
+        '/api/v1/top_employees/<year>/': [
+            '/api/v1/top_employees/{}/'.format(year) for year in months
+        ],
+        '/api/v1/top_employees/<year>/<month>/': [
+            '/api/v1/top_employees/{}/{}/'.format(year, month)
+            for year in months
+            for month in months[year]
+        ],
+    }
+    for endpoint in USER_ENDPOINTS:
+        urls[endpoint.format('<user_id>')] = [
+            endpoint.format(user_id) for user_id in user_ids
+        ]
+    for rule, rule_urls in urls.iteritems():
+        results[rule] = measure_requests(client, rule_urls, repeat)
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'rows': rows,
+        'users': users,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def run_benchmark(output, users=100, days=250, repeat=5):
+    """
+    Benchmarks a generated dataset and writes results as JSON
+    to output file.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        csv_path, xml_path, rows = generate_dataset(directory, users, days)
+        log.info('Generated %d rows for %d users', rows, users)
+        report = benchmark(csv_path, xml_path, repeat=repeat)
+    finally:
+        shutil.rmtree(directory)
+    with open(output, 'w') as outfile:
+        json.dump(report, outfile, indent=4, sort_keys=True)
+    return report
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Memory-bounded LRU cache with per-entry expiry and versions.
+"""
+
+import logging
+import sys
+import threading
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import metrics
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+MAX_ENTRIES = 10000
+
+
+def sizeof(value):
+    """
+    Estimates number of bytes taken by a value and all objects it
+    references. Objects shared between parts of the value are counted
+    once.
+    """
+    seen = set()
+    stack = [value]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.iterkeys())
+            stack.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return total
+
+
+class Cache(object):
+    """
+    Thread-safe cache of values keyed by (namespace, name[, args]) tuples.
+
+    Every entry may expire after a number of seconds and remembers
+    version of data it was computed from. Least recently used entries
+    are evicted when there are more than <prefix>MAX_ENTRIES
+    (MAX_ENTRIES by default) of them or their estimated size exceeds
+    <prefix>MAX_BYTES. Limits are read from `settings` mapping on every
+    store, sizes are estimated only when a byte limit is set. Entries
+    stored as not evictable are neither sized nor evicted, their memory
+    has to be accounted by the caller.
+
+    Entries are dicts like this:
+    entry = {
+        'data': {...},
+        'expire': datetime.datetime(2013, 9, 10, 12, 0, 0),
+        'version': '53a2e456978c0-258',
+        'size': 18432,
+        'evictable': True,
+    }
+    """
+
+    def __init__(self, settings=None, prefix='CACHE_'):
+        self.settings = settings if settings is not None else {}
+        self.prefix = prefix
+        self.size = 0
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __getitem__(self, key):
+        with self._lock:
+            return self._entries[key]
+
+    def __setitem__(self, key, entry):
+        self.store(
+            key,
+            entry['data'],
+            version=entry.get('version'),
+            evictable=entry.get('evictable', True),
+        )
+        self._entries[key]['expire'] = entry.get('expire')
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self):
+        """
+        Returns keys from least to most recently used.
+        """
+        with self._lock:
+            return self._entries.keys()
+
+    def get(self, key, default=None):
+        """
+        Returns entry of key without marking it as used.
+        """
+        with self._lock:
+            return self._entries.get(key, default)
+
+    def pop(self, key, default=None):
+        """
+        Removes entry of key and returns it.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self.size -= entry['size']
+            return entry
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def fetch(self, key, version=None):
+        """
+        Returns (entry, fresh) pair of key and marks the entry as used.
+
+        Entry is fresh if it did not expire and was computed from given
+        version of data. Stale entries are kept, so they can be served
+        while a fresh value is computed. Entry is None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None, False
+            self._entries[key] = entry
+            fresh = entry['version'] == version and (
+                entry['expire'] is None or datetime.now() <= entry['expire']
+            )
+            self.stats['hits' if fresh else 'stale'] += 1
+            return entry, fresh
+
+    def store(self, key, data, secs=None, version=None, evictable=True):
+        """
+        Stores value computed from given version of data, expiring after
+        secs seconds (never if None), and evicts least recently used
+        entries over the limits. Returns the value.
+        """
+        max_bytes = self.settings.get(self.prefix + 'MAX_BYTES')
+        max_entries = self.settings.get(
+            self.prefix + 'MAX_ENTRIES', MAX_ENTRIES,
+        )
+        size = sizeof(data) if max_bytes and evictable else 0
+        entry = {
+            'data': data,
+            'expire': (
+                datetime.now() + timedelta(seconds=secs)
+                if secs is not None else None
+            ),
+            'version': version,
+            'size': size,
+            'evictable': evictable,
+        }
+        with self._lock:
+            self.pop(key)
+            self._entries[key] = entry
+            self.size += size
+            while (max_bytes and self.size > max_bytes or
+                   max_entries and len(self._entries) > max_entries):
+                if not self._evict(keep=key):
+                    break
+        return data
+
+    def _evict(self, keep):
+        """
+        Removes the least recently used evictable entry other than keep.
+        Returns False if there is none.
+        """
+        for key, entry in self._entries.iteritems():
+            if entry['evictable'] and key != keep:
+                break
+        else:
+            return False
+        del self._entries[key]
+        self.size -= entry['size']
+        self.stats['evictions'] += 1
+        metrics.inc('presence_cache_evictions_total', function=key[1])
+        log.debug('Evicted %s from cache', key)
+        return True
+
+    def invalidate(self, namespace, name=None):
+        """
+        Removes entries of a namespace, or only of given function in it.
+        Returns number of removed entries.
+        """
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if key[0] == namespace and name in (None, key[1])
+            ]
+            for key in keys:
+                self.pop(key)
+        return len(keys)
+
+    def pin(self, namespace=None):
+        """
+        Makes entries (of a namespace, or all of them) never expire.
+        Returns number of pinned entries.
+        """
+        with self._lock:
+            entries = [
+                entry for key, entry in self._entries.iteritems()
+                if namespace in (None, key[0])
+            ]
+            for entry in entries:
+                entry['expire'] = None
+        return len(entries)
+
+    def info(self):
+        """
+        Returns statistics of the cache.
+        """
+        with self._lock:
+            return dict(
+                self.stats, entries=len(self._entries), bytes=self.size,
+            )
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Event-loop server handling many concurrent connections in one process.
+"""
+
+import logging
+
+import utils
+from startup import warm_up
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+def serve(app, host='0.0.0.0', port=8080, connections=1000):
+    """
+    Serves the application with gevent's WSGI server.
+
+    Every connection is handled by a greenlet instead of a thread, so
+    thousands of idle or slow dashboard connections are held by one
+    process, up to `connections` at a time. The application does no
+    network I/O itself, so nothing is monkey-patched. Dataset is loaded
+    before serving, later loads and recomputes of cached values (also
+    after the dataset version changes) run in gevent's thread pool, so
+    the loop keeps answering other connections meanwhile.
+
+    Requires gevent (pip install presence_analyzer[evented]).
+    """
+    # deferred, gevent is an optional dependency
+    from gevent import get_hub
+    from gevent.local import local
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+
+    # greenlets of one thread must not share the selected dataset
+    utils.LOCAL = local()
+    warm_up()
+    utils.OFFLOAD = get_hub().threadpool.apply
+    server = WSGIServer((host, port), app, spawn=Pool(connections))
+    log.info(
+        'Serving on http://%s:%d with up to %d connections',
+        host, port, connections,
+    )
+    server.serve_forever()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Paginated and streamed export of raw presence records.
+"""
+
+import base64
+import bisect
+import json
+
+from datetime import datetime
+
+from utils import get_data, get_storage
+
+
+def encode_cursor(user_id, date):
+    """
+    Returns opaque cursor pointing right after given record.
+    """
+    return base64.urlsafe_b64encode(
+        '{}:{}'.format(user_id, date.isoformat())
+    )
+
+
+def decode_cursor(cursor):
+    """
+    Returns (user_id, date) pair encoded in cursor.
+
+    Raises ValueError if cursor is malformed.
+    """
+    try:
+        user_id, date = base64.urlsafe_b64decode(str(cursor)).split(':')
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor: {}'.format(cursor))
+    return int(user_id), datetime.strptime(date, '%Y-%m-%d').date()
+
+
+def iter_records(user_id=None, since=None, until=None, after=None):
+    """
+    Yields (user_id, date, start, end) records ordered by user and date.
+
+    Records can be limited to a user, dates between since and until
+    (inclusive) and to records following `after` (user_id, date) pair.
+    Indexed storage filters records itself, otherwise they are read
+    from loaded dataset one user at a time.
+    """
+    storage = get_storage()
+    if storage.indexed:
+        for record in storage.records(user_id, since, until, after):
+            yield record
+        return
+
+    data = get_data()
+    if user_id is not None:
+        user_ids = [user_id] if user_id in data else []
+    else:
+        user_ids = sorted(data)
+    if after is not None:
+        user_ids = user_ids[bisect.bisect_left(user_ids, after[0]):]
+    for current_id in user_ids:
+        items = data[current_id]
+        dates = sorted(items)
+        first = 0
+        if since is not None:
+            first = bisect.bisect_left(dates, since)
+        if after is not None and current_id == after[0]:
+            first = max(first, bisect.bisect_right(dates, after[1]))
+        last = len(dates)
+        if until is not None:
+            last = bisect.bisect_right(dates, until)
+        for date in dates[first:last]:
+            yield current_id, date, items[date]['start'], items[date]['end']
+
+
+def record_to_dict(record):
+    """
+    Converts record to a dict in the format accepted by ingest.
+    """
+    user_id, date, start, end = record
+    return {
+        'user_id': user_id,
+        'date': date.isoformat(),
+        'start': start.strftime('%H:%M:%S'),
+        'end': end.strftime('%H:%M:%S'),
+    }
+
+
+def ndjson_lines(records):
+    """
+    Yields records as newline delimited JSON.
+    """
+    for record in records:
+        yield json.dumps(record_to_dict(record), sort_keys=True) + '\n'
+
+
+def csv_lines(records):
+    """
+    Yields records as lines of DATA_CSV format.
+    """
+    for user_id, date, start, end in records:
+        yield '{},{},{},{}\n'.format(
+            user_id,
+            date.isoformat(),
+            start.strftime('%H:%M:%S'),
+            end.strftime('%H:%M:%S'),
+        )
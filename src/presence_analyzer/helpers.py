@@ -2,3 +2,66 @@
 """
 Helper functions used in templates.
 """
+
+import hashlib
+import os
+import threading
+
+from flask import request, url_for
+
+from main import app
+
+ASSET_HASHES = {}
+ASSET_HASHES_LOCK = threading.Lock()
+# a year, the longest period allowed by RFC 2616
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def asset_hash(filename):
+    """
+    Returns short hash of a static file content.
+
+    Files are hashed once per process, as they change only on deploy.
+    """
+    with ASSET_HASHES_LOCK:
+        if filename not in ASSET_HASHES:
+            path = os.path.join(app.static_folder, filename.lstrip('/'))
+            with open(path, 'rb') as asset:
+                ASSET_HASHES[filename] = hashlib.md5(
+                    asset.read()
+                ).hexdigest()[:12]
+        return ASSET_HASHES[filename]
+
+
+def static_url(filename):
+    """
+    Returns URL of a static file fingerprinted with its content hash,
+    so it can be cached forever and changes whenever the file does.
+    """
+    return url_for('static', filename=filename, v=asset_hash(filename))
+
+
+@app.context_processor
+def template_helpers():
+    """
+    Makes helpers available in templates.
+    """
+    return {'static_url': static_url}
+
+
+@app.after_request
+def cache_static(response):
+    """
+    Marks static files requested with their current fingerprint as
+    immutable. Other static responses have to be revalidated, so an old
+    or made up fingerprint is never cached for long.
+    """
+    if request.endpoint != 'static' or \
+            response.status_code not in (200, 304):
+        return response
+    if request.args.get('v') == asset_hash(request.view_args['filename']):
+        response.headers['Cache-Control'] = \
+            'public, max-age={}, immutable'.format(IMMUTABLE_MAX_AGE)
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Ingestion of new presence rows.
+"""
+
+import csv
+import json
+import logging
+import threading
+
+from itertools import islice
+
+from main import app
+from storage import (
+    new_report,
+    parse_row,
+    reject_line,
+    resolve_duplicate,
+)
+from utils import (
+    CACHE,
+    cache_key,
+    copy_rollup_cell,
+    dataset_state,
+    duplicate_policy,
+    get_entry,
+    get_storage,
+    rollup_period,
+    update_rollup,
+)
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+INGEST_LOCK = threading.Lock()
+
+NDJSON_FIELDS = ('user_id', 'date', 'start', 'end')
+
+
+def parse_csv_lines(lines):
+    """
+    Yields (line_number, row) pairs of CSV lines.
+
+    Row is None if line is malformed.
+    """
+    for i, row in enumerate(csv.reader(lines, delimiter=','), 1):
+        if not row:
+            continue
+        try:
+            if len(row) != 4:
+                raise ValueError('Expected 4 columns, got {}'.format(len(row)))
+            yield i, parse_row(row)
+        except (ValueError, TypeError):
+            log.debug('Problem with line %d: ', i, exc_info=True)
+            yield i, None
+
+
+def parse_ndjson_lines(lines):
+    """
+    Yields (line_number, row) pairs of newline delimited JSON objects
+    with user_id, date, start and end keys.
+
+    Row is None if line is malformed.
+    """
+    for i, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            yield i, parse_row([
+                unicode(item[field]) for field in NDJSON_FIELDS
+            ])
+        except (ValueError, TypeError, KeyError):
+            log.debug('Problem with line %d: ', i, exc_info=True)
+            yield i, None
+
+
+def _own_rollup_cell(cube, owned, user_id, date):
+    """
+    Replaces dicts on the path to the rollup cell of given user and date
+    with copies, once per set of owned keys, so the cell can be updated
+    without changing the cube requests may be reading.
+    """
+    year, month = rollup_period(date)
+    if year not in owned:
+        cube[year] = dict(cube.get(year, {}))
+        owned.add(year)
+    if (year, month) not in owned:
+        cube[year][month] = dict(cube[year].get(month, {}))
+        owned.add((year, month))
+    users = cube[year][month]
+    if (year, month, user_id) not in owned:
+        if user_id in users:
+            users[user_id] = copy_rollup_cell(users[user_id])
+        owned.add((year, month, user_id))
+
+
+def apply_rows(rows):
+    """
+    Updates cached get_data() and rollup cube with new rows.
+
+    Cached values are never changed in place, as requests iterate them
+    without locks. Dicts of changed users and rollup cells are copied,
+    updated and swapped in, so readers see either the old or the new
+    value. Work is proportional to the number of rows and history of
+    their users. Caches which are not loaded yet will read the new rows
+    from storage, values memoized per version are recomputed once the
+    dataset version changes.
+    """
+    entry = CACHE.get(cache_key('get_data'))
+    rollup = CACHE.get(cache_key('get_rollup'))
+    if entry is None or rollup is not None and (
+            rollup['version'] != dataset_state()['version']):
+        # rollup can not be updated without knowing replaced entries
+        # or when it was computed from an older version
+        CACHE.pop(cache_key('get_rollup'), None)
+        rollup = None
+    if entry is None:
+        return
+    data = dict(entry['data'])
+    cube = dict(rollup['data']) if rollup is not None else None
+    users = set()
+    owned = set()
+    for user_id, date, start, end in rows:
+        if user_id not in users:
+            data[user_id] = dict(data.get(user_id, {}))
+            users.add(user_id)
+        user_data = data[user_id]
+        old = user_data.get(date)
+        if cube is not None:
+            _own_rollup_cell(cube, owned, user_id, date)
+            if old is not None:
+                update_rollup(
+                    cube, user_id, date,
+                    old['start'], old['end'], sign=-1,
+                )
+            update_rollup(cube, user_id, date, start, end)
+        user_data[date] = {'start': start, 'end': end}
+    entry['data'] = data
+    if rollup is not None:
+        rollup['data'] = cube
+
+
+def resolve_rows(chunk, policy, summary):
+    """
+    Returns valid rows of parsed (line_number, row) pairs, with repeated
+    user and date resolved by duplicate policy against stored entries
+    and earlier rows of the chunk. Rejected lines are counted in summary.
+
+    Only entries of user and date pairs of the chunk are looked up,
+    so work does not depend on history of the users.
+    """
+    entries = {}
+    rows = []
+    for i, row in chunk:
+        if row is None:
+            reject_line(summary, i)
+            continue
+        user_id, date, start, end = row
+        key = (user_id, date)
+        if key not in entries:
+            entries[key] = get_entry(user_id, date)
+        old = entries[key]
+        if old is not None:
+            summary['duplicates'] += 1
+            kept = resolve_duplicate(old, start, end, policy)
+            if kept is None:
+                reject_line(summary, i)
+                continue
+            start, end = kept
+        entries[key] = {'start': start, 'end': end}
+        rows.append((user_id, date, start, end))
+    return rows
+
+
+def ingest(parsed_lines, batch_size=None):
+    """
+    Stores valid rows in batches and applies them to in-memory caches.
+
+    Rows repeating user and date of stored entries are resolved with
+    DUPLICATE_POLICY before they are stored, so reloading the dataset
+    gives the same result. Returns a summary with numbers of accepted,
+    rejected and duplicated rows and line numbers of first
+    MAX_REJECTED_LINES rejected ones.
+    """
+    batch_size = batch_size or app.config.get('INGEST_BATCH_SIZE', 1000)
+    policy = duplicate_policy()
+    summary = new_report(policy)
+    parsed_lines = iter(parsed_lines)
+    while True:
+        chunk = list(islice(parsed_lines, batch_size))
+        if not chunk:
+            break
+        with INGEST_LOCK:
+            rows = resolve_rows(chunk, policy, summary)
+            if not rows:
+                continue
+            storage = get_storage()
+            storage.append(rows)
+            apply_rows(rows)
+            version = dataset_state()['version'] = storage.version()
+            rollup = CACHE.get(cache_key('get_rollup'))
+            if rollup is not None:
+                # updated by apply_rows(), it is not rebuilt for the new version
+                rollup['version'] = version
+        summary['accepted'] += len(rows)
+    return summary
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Counters and timing histograms exposed in Prometheus text format.
+"""
+
+import threading
+import time
+
+from contextlib import contextmanager
+
+from main import app
+
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+COUNTERS = {}
+HISTOGRAMS = {}
+LOCK = threading.Lock()
+
+
+def enabled():
+    """
+    Checks if metrics are collected. Controlled by METRICS_ENABLED option.
+    """
+    return app.config.get('METRICS_ENABLED', False)
+
+
+def _key(name, labels):
+    """
+    Returns hashable key of a metric with labels.
+    """
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """
+    Increases counter by value.
+    """
+    if not enabled():
+        return
+    key = _key(name, labels)
+    with LOCK:
+        COUNTERS[key] = COUNTERS.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """
+    Records value (in seconds) in a histogram.
+    """
+    if not enabled():
+        return
+    key = _key(name, labels)
+    with LOCK:
+        if key not in HISTOGRAMS:
+            HISTOGRAMS[key] = {
+                'buckets': [0] * len(BUCKETS),
+                'sum': 0,
+                'count': 0,
+            }
+        histogram = HISTOGRAMS[key]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+
+@contextmanager
+def timed(name, **labels):
+    """
+    Records duration of the block in a histogram.
+    """
+    if not enabled():
+        yield
+        return
+    started = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - started, **labels)
+
+
+def reset():
+    """
+    Drops all collected metrics.
+    """
+    with LOCK:
+        COUNTERS.clear()
+        HISTOGRAMS.clear()
+
+
+def _format_labels(labels, **extra):
+    """
+    Formats labels as {key="value",...}.
+    """
+    items = list(labels) + sorted(extra.items())
+    if not items:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(
+            key,
+            str(value).replace('\\', '\\\\').replace('"', '\\"'),
+        )
+        for key, value in items
+    ))
+
+
+def render():
+    """
+    Returns all metrics in Prometheus text exposition format.
+    """
+    lines = []
+    with LOCK:
+        counters = sorted(COUNTERS.items())
+        histograms = sorted(
+            (key, dict(value, buckets=list(value['buckets'])))
+            for key, value in HISTOGRAMS.items()
+        )
+    typed = set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append('# TYPE {} counter'.format(name))
+            typed.add(name)
+        lines.append('{}{} {}'.format(name, _format_labels(labels), value))
+    for (name, labels), histogram in histograms:
+        if name not in typed:
+            lines.append('# TYPE {} histogram'.format(name))
+            typed.add(name)
+        for bound, count in zip(BUCKETS, histogram['buckets']):
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(labels, le=repr(bound)), count,
+            ))
+        lines.append('{}_bucket{} {}'.format(
+            name, _format_labels(labels, le='+Inf'), histogram['count'],
+        ))
+        lines.append('{}_sum{} {!r}'.format(
+            name, _format_labels(labels), histogram['sum'],
+        ))
+        lines.append('{}_count{} {}'.format(
+            name, _format_labels(labels), histogram['count'],
+        ))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Occupancy engine: number of people present at each moment of a day.
+"""
+
+from sketches import SECONDS_PER_DAY
+from utils import get_data, memoize_per_version, seconds_since_midnight
+
+
+def slots_count(resolution):
+    """
+    Returns number of `resolution` seconds slots in a day.
+    """
+    return (SECONDS_PER_DAY + resolution - 1) // resolution
+
+
+def add_intervals(diff, intervals, resolution):
+    """
+    Marks (start, end) intervals in a difference array in place.
+
+    Person is counted in every slot overlapping [start, end).
+    Empty and negative intervals are skipped.
+    """
+    for start, end in intervals:
+        if end <= start:
+            continue
+        diff[start // resolution] += 1
+        diff[(end - 1) // resolution + 1] -= 1
+    return diff
+
+
+def prefix_sums(diff, resolution, divisor=None):
+    """
+    Turns difference array into a list of (slot start, value) pairs.
+
+    Values are divided by divisor if it is given.
+    """
+    result = []
+    current = 0
+    for slot, change in enumerate(diff[:-1]):
+        current += change
+        result.append((
+            slot * resolution,
+            current / float(divisor) if divisor else current,
+        ))
+    return result
+
+
+def occupancy_curve(intervals, resolution=60):
+    """
+    Returns headcount in every slot of a day for given intervals
+    as a list of (slot start, headcount) pairs.
+
+    Runs in time linear in number of intervals plus number of slots.
+    """
+    diff = [0] * (slots_count(resolution) + 1)
+    add_intervals(diff, intervals, resolution)
+    return prefix_sums(diff, resolution)
+
+
+@memoize_per_version
+def get_intervals_by_date():
+    """
+    Groups presence intervals of all users by date.
+
+    It creates structure like this:
+    data = {
+        datetime.date(2013, 9, 10): [(34745, 64792), (33590, 50154)],
+    }
+    """
+    data = {}
+    for items in get_data().itervalues():
+        for date, item in items.iteritems():
+            data.setdefault(date, []).append((
+                seconds_since_midnight(item['start']),
+                seconds_since_midnight(item['end']),
+            ))
+    return data
+
+
+@memoize_per_version
+def weekday_occupancy(resolution=60):
+    """
+    Returns average headcount in every slot of a day for each weekday.
+
+    Intervals of all days are accumulated in one difference array per
+    weekday and divided by the number of days, so work is linear in
+    the number of intervals.
+    """
+    slots = slots_count(resolution)
+    diffs = [[0] * (slots + 1) for _ in range(7)]
+    days = [0] * 7
+    for date, intervals in get_intervals_by_date().iteritems():
+        add_intervals(diffs[date.weekday()], intervals, resolution)
+        days[date.weekday()] += 1
+    return [
+        prefix_sums(diff, resolution, days[weekday] or 1)
+        for weekday, diff in enumerate(diffs)
+    ]
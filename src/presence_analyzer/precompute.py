@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Materializes API responses to static files.
+"""
+
+import gzip
+import logging
+import multiprocessing
+import os
+
+from cStringIO import StringIO
+
+from main import app
+from utils import get_data, get_data_by_month
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+USER_ENDPOINTS = (
+    'mean_time_weekday',
+    'presence_weekday',
+    'presence_start_end',
+    'presence_start_end_distribution',
+    'anomalies',
+    'bundle/user',
+)
+
+
+def api_urls():
+    """
+    Returns URLs of every /api/v1/ response for the current dataset.
+    """
+    urls = [
+        '/api/v1/years',
+        '/api/v1/users',
+        '/api/v1/anomalies',
+        '/api/v1/company/mean_time_weekday',
+        '/api/v1/company/headcount',
+        '/api/v1/company/arrival_curve',
+        '/api/v1/bundle/top_employees',
+        '/api/v1/occupancy/weekday',
+    ]
+    for year, months in sorted(get_data_by_month().items()):
+        urls.append('/api/v1/top_employees/{}/'.format(year))
+        urls.extend(
+            '/api/v1/top_employees/{}/{}/'.format(year, month)
+            for month in sorted(months)
+        )
+    for user_id in sorted(get_data()):
+        urls.extend(
+            '/api/v1/{}/{}'.format(endpoint, user_id)
+            for endpoint in USER_ENDPOINTS
+        )
+    return urls
+
+
+def url_to_path(target, url):
+    """
+    Maps API url to a file path under target directory.
+
+    Urls ending with a slash are stored as index.json inside a directory,
+    the rest gets .json suffix, so a proxy can serve them with
+    `try_files $uri.json $uri/index.json`.
+    """
+    path = url.strip('/')
+    if url.endswith('/'):
+        path = os.path.join(path, 'index')
+    return os.path.join(target, path + '.json')
+
+
+def gzip_bytes(content):
+    """
+    Compresses content with gzip. Timestamp is fixed, so equal content
+    always gives equal bytes.
+    """
+    buf = StringIO()
+    gzfile = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0)
+    try:
+        gzfile.write(content)
+    finally:
+        gzfile.close()
+    return buf.getvalue()
+
+
+def _write(path, content):
+    """
+    Writes content to a file atomically.
+    """
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as outfile:
+        outfile.write(content)
+    os.rename(tmp_path, path)
+
+
+def materialize(url, target):
+    """
+    Renders single url and writes its plain and gzipped body to target.
+
+    Returns written path or None if response was not successful.
+    """
+    resp = app.test_client().get(url)
+    if resp.status_code != 200:
+        log.warning('Skipping %s: status %d', url, resp.status_code)
+        return None
+    path = url_to_path(target, url)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created concurrently by another worker
+            if not os.path.isdir(directory):
+                raise
+    _write(path, resp.data)
+    _write(path + '.gz', gzip_bytes(resp.data))
+    return path
+
+
+def _materialize_star(args):
+    """
+    Unpacks arguments for Pool.imap_unordered.
+    """
+    return materialize(*args)
+
+
+def precompute(target, workers=0):
+    """
+    Writes every API response to target directory.
+
+    Dataset is loaded once before any work is distributed, so forked
+    workers share it instead of parsing it again. With workers <= 1 all
+    urls are rendered in the current process.
+    """
+    urls = api_urls()
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            paths = list(pool.imap_unordered(
+                _materialize_star,
+                [(url, target) for url in urls],
+                chunksize=16,
+            ))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        paths = [materialize(url, target) for url in urls]
+    written = [path for path in paths if path is not None]
+    log.info(
+        'Materialized %d of %d urls in %s', len(written), len(urls), target,
+    )
+    return written
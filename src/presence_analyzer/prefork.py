@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-fork server sharing the dataset loaded in the master process.
+"""
+
+import errno
+import gc
+import logging
+import os
+import signal
+import threading
+
+from werkzeug.serving import make_server
+
+from startup import warm_up
+from storage import file_version
+from utils import (
+    CACHE,
+    ENCODED,
+    current_dataset,
+    dataset_config,
+    dataset_state,
+    get_storage,
+)
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+# collections of the young generations are made rare and full ones
+# very rare, as they write to every object shared with the master
+WORKER_GC_THRESHOLDS = (100000, 50, 100)
+
+RELOAD_LOCK = threading.Lock()
+
+
+def freeze_dataset():
+    """
+    Loads the dataset, pins it in cache and moves it out of garbage
+    collector's reach.
+
+    Pinned entries never expire, so workers do not parse the dataset
+    again and keep sharing the master's copy until its files change,
+    see reload_changed(). Collector traversing
+    objects writes to them, which makes forked workers copy pages
+    shared with the master. gc.freeze() (Python 3.7+) moves all objects
+    to a permanent generation, on older versions the dataset is only
+    collected once before forking and workers call tune_worker_gc().
+    """
+    warm_up()
+    CACHE.pin()
+    gc.collect()
+    freeze = getattr(gc, 'freeze', None)
+    if freeze is not None:
+        freeze()
+    else:
+        log.info('gc.freeze() is not available, skipping')
+
+
+def _changed():
+    """
+    Checks if files of the selected dataset changed since it was loaded.
+    """
+    state = dataset_state()
+    if state['version'] is None:
+        return False
+    if get_storage().version() != state['version']:
+        return True
+    users = state['users']
+    return users is not None and (
+        file_version(dataset_config('DATA_XML')) != users
+    )
+
+
+def reload_changed():
+    """
+    Reloads and pins again the selected dataset of a worker when its
+    files changed, e.g. DATA_CSV was replaced, users file was updated
+    or rows were ingested by another worker. Returns True if the
+    dataset was reloaded.
+
+    Registered to run before every request of workers, it costs two
+    stat() calls when nothing changed.
+    """
+    if not _changed():
+        return False
+    with RELOAD_LOCK:
+        if not _changed():
+            return False
+        name = current_dataset()
+        log.info('Dataset %s changed, reloading', name)
+        CACHE.invalidate(name)
+        ENCODED.invalidate(name)
+        warm_up()
+        CACHE.pin(name)
+    return True
+
+
+def tune_worker_gc():
+    """
+    Raises collector thresholds of a worker when gc.freeze()
+    is not available.
+    """
+    if getattr(gc, 'freeze', None) is None:
+        gc.set_threshold(*WORKER_GC_THRESHOLDS)
+
+
+def run_workers(server, workers):
+    """
+    Forks workers accepting connections on the server socket and
+    restarts the ones which died. Returns after SIGTERM or SIGINT.
+    """
+    children = set()
+    stopping = []
+
+    def stop(signum, frame):  # pylint: disable=unused-argument
+        """
+        Stops spawning and terminates all workers.
+        """
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while not stopping:
+        while len(children) < workers and not stopping:
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                tune_worker_gc()
+                try:
+                    server.serve_forever()
+                finally:
+                    os._exit(0)  # pylint: disable=protected-access
+            log.info('Started worker %d', pid)
+            children.add(pid)
+        try:
+            pid, _ = os.wait()
+        except OSError as err:
+            if err.errno == errno.EINTR:
+                continue
+            raise
+        children.discard(pid)
+        if not stopping:
+            log.warning('Worker %d exited, restarting', pid)
+
+    for pid in children:
+        try:
+            os.waitpid(pid, 0)
+        except OSError:
+            pass
+    server.server_close()
+
+
+def serve(app, host='0.0.0.0', port=8080, workers=4):
+    """
+    Serves the application with pre-forked workers.
+
+    The dataset is loaded and frozen in the master once, and forked
+    workers share it copy-on-write, so requests are handled on several
+    cores without a copy of the dataset per worker. A worker reloads
+    the dataset on its own once its files change.
+    """
+    freeze_dataset()
+    app.before_request(reload_changed)
+    server = make_server(host, port, app, threaded=True)
+    log.info(
+        'Serving on http://%s:%d with %d workers', host, port, workers,
+    )
+    run_workers(server, workers)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Per-request profiling middleware.
+"""
+
+import cProfile
+import hmac
+import logging
+import os
+import random
+import threading
+import time
+
+from werkzeug.exceptions import HTTPException
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+
+class ProfilerMiddleware(object):
+    """
+    Runs cProfile on a sampled fraction of requests and on requests
+    carrying the debug header set to the secret.
+
+    Every profiled request is dumped in pstats format to
+    `<directory>/<endpoint>/<timestamp>-<pid>.prof`, which can be read
+    with pstats or turned into a flamegraph with tools like flameprof.
+    Header is ignored when no secret is given, and profiling stops once
+    max_dumps profiles were written by the process.
+    """
+
+    def __init__(self, app, url_map, directory, sample_rate=0.0,
+                 header='X-Profile', secret=None, max_dumps=1000):
+        self.app = app
+        self.url_map = url_map
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.environ_header = 'HTTP_{}'.format(
+            header.upper().replace('-', '_'),
+        )
+        self.secret = secret.encode('utf-8') if isinstance(
+            secret, unicode) else secret
+        self.max_dumps = max_dumps
+        self.dumps = 0
+        self._lock = threading.Lock()
+
+    def has_secret(self, environ):
+        """
+        Checks if request carries the debug header set to the secret.
+        """
+        value = environ.get(self.environ_header)
+        if not self.secret or not value:
+            return False
+        if isinstance(value, unicode):
+            value = value.encode('latin-1', 'replace')
+        return hmac.compare_digest(value, self.secret)
+
+    def should_profile(self, environ):
+        """
+        Checks if request has the debug header or was sampled, and
+        reserves a dump for it unless the limit was reached.
+        """
+        if not self.has_secret(environ) and not (
+                self.sample_rate > 0 and random.random() < self.sample_rate):
+            return False
+        with self._lock:
+            if self.dumps >= self.max_dumps:
+                return False
+            self.dumps += 1
+            if self.dumps == self.max_dumps:
+                log.warning(
+                    'Written %d profiles, profiling stops', self.max_dumps,
+                )
+        return True
+
+    def endpoint(self, environ):
+        """
+        Returns name of the endpoint handling the request.
+        """
+        try:
+            endpoint, _ = self.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return 'unmatched'
+        return endpoint
+
+    def dump(self, profile, environ):
+        """
+        Writes profile stats of a request to a file and returns its path.
+        """
+        directory = os.path.join(self.directory, self.endpoint(environ))
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created concurrently by another thread
+                if not os.path.isdir(directory):
+                    raise
+        path = os.path.join(directory, '{:.6f}-{}.prof'.format(
+            time.time(), os.getpid(),
+        ))
+        profile.dump_stats(path)
+        log.info('Profile of %s written to %s', environ.get('PATH_INFO'), path)
+        return path
+
+    def __call__(self, environ, start_response):
+        if not self.should_profile(environ):
+            return self.app(environ, start_response)
+
+        body = []
+
+        def run_app():
+            """
+            Runs the application and consumes its response.
+            """
+            app_iter = self.app(environ, start_response)
+            try:
+                body.extend(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+
+        profile = cProfile.Profile()
+        try:
+            profile.runcall(run_app)
+        finally:
+            self.dump(profile, environ)
+        return body
@@ -33,9 +33,46 @@ def make_app(global_conf={}, config=DEPLOY_CFG, debug=False):
     from presence_analyzer import app
     app.config.from_pyfile(abspath(config))
     app.debug = debug
+    install_profiler(app)
+    prepare_startup(app)
     return app
 
 
+def prepare_startup(app):
+    """
+    Precompiles templates and warms the dataset if enabled in config.
+
+    Compiled templates are cached in var/mako unless
+    MAKO_MODULE_DIRECTORY is configured.
+    """
+    from presence_analyzer.startup import prepare
+    if not app.config.get('MAKO_MODULE_DIRECTORY'):
+        app.config['MAKO_MODULE_DIRECTORY'] = abspath('var', 'mako')
+    prepare()
+
+
+def install_profiler(app):
+    """
+    Wraps the application with profiling middleware if PROFILE_ENABLED.
+
+    Nothing is installed otherwise, so there is no cost when it is off.
+    """
+    from presence_analyzer.profiling import ProfilerMiddleware
+    if not app.config.get('PROFILE_ENABLED'):
+        return
+    if isinstance(app.wsgi_app, ProfilerMiddleware):
+        return
+    app.wsgi_app = ProfilerMiddleware(
+        app.wsgi_app,
+        app.url_map,
+        app.config.get('PROFILE_DIR', abspath('var', 'profile')),
+        sample_rate=app.config.get('PROFILE_SAMPLE_RATE', 0.0),
+        header=app.config.get('PROFILE_HEADER', 'X-Profile'),
+        secret=app.config.get('PROFILE_SECRET'),
+        max_dumps=app.config.get('PROFILE_MAX_DUMPS', 1000),
+    )
+
+
 # bin/paster serve parts/etc/debug.ini
 def make_debug(global_conf={}, **conf):
     from werkzeug.debug import DebuggedApplication
@@ -64,6 +101,70 @@ def make_shell():
     return locals()
 
 
+# bin/flask-ctl precompute
+def precompute(target, workers=0, config=DEPLOY_CFG):
+    """
+    Writes every /api/v1/ response as static JSON files.
+    """
+    from presence_analyzer.precompute import precompute as _precompute
+    make_app(config=config)
+    paths = _precompute(abspath(target), workers=workers)
+    print 'Written {} files to {}'.format(len(paths), abspath(target))
+
+
+# bin/flask-ctl load_sqlite
+def load_sqlite(config=DEPLOY_CFG):
+    """
+    Rebuilds DATA_SQLITE database from DATA_CSV file.
+    """
+    from presence_analyzer.storage import SQLiteStorage, new_report
+    app = make_app(config=config)
+    storage = SQLiteStorage(app.config['DATA_SQLITE'])
+    report = new_report(app.config.get('DUPLICATE_POLICY', 'last'))
+    count = storage.load_csv(
+        app.config['DATA_CSV'], policy=report['policy'], report=report,
+    )
+    print 'Loaded {} rows to {}'.format(count, app.config['DATA_SQLITE'])
+    print 'Rejected {} lines, {} duplicates'.format(
+        report['rejected'], report['duplicates'],
+    )
+
+
+# bin/flask-ctl benchmark
+def benchmark(output, users, days, repeat, config=DEPLOY_CFG):
+    """
+    Benchmarks the application on a generated dataset.
+    """
+    from presence_analyzer.benchmark import run_benchmark
+    make_app(config=config)
+    report = run_benchmark(abspath(output), users, days, repeat)
+    for name, result in sorted(report['results'].items()):
+        print '{:45} mean {:10.6f}s  p99 {:10.6f}s'.format(
+            name, result['mean'], result['p99'],
+        )
+    print 'Results written to {}'.format(abspath(output))
+
+
+def _serve_prefork(host, port, workers, dry_run=False):
+    """Serve with pre-forked workers sharing the loaded dataset."""
+    print 'prefork http://{}:{} workers={}'.format(host, port, workers)
+    if dry_run:
+        return
+    from presence_analyzer.prefork import serve
+    serve(make_app(), host=host, port=port, workers=workers)
+
+
+def _serve_evented(host, port, connections, dry_run=False):
+    """Serve many concurrent connections from one event loop."""
+    print 'evented http://{}:{} connections={}'.format(
+        host, port, connections,
+    )
+    if dry_run:
+        return
+    from presence_analyzer.evented import serve
+    serve(make_app(), host=host, port=port, connections=connections)
+
+
 def _serve(action, debug=False, dry_run=False):
     """Build paster command from 'action' and 'debug' flag."""
     if debug:
@@ -97,17 +198,35 @@ def run():
     action_shell = werkzeug.script.make_shell(make_shell, make_shell.__doc__)
 
     # bin/flask-ctl serve [fg|start|stop|restart|status]
-    def action_serve(action=('a', 'start'), dry_run=False):
+    # bin/flask-ctl serve prefork [--workers=4] [--host=...] [--port=8080]
+    # bin/flask-ctl serve evented [--connections=1000] [--port=8080]
+    def action_serve(action=('a', 'start'), dry_run=False, workers=('w', 4),
+                     host='0.0.0.0', port=('p', 8080),
+                     connections=('c', 1000)):
         """Serve the application.
 
         This command serves a web application that uses a paste.deploy
         configuration file for the server and application.
 
+        The 'prefork' action instead loads the dataset once and serves
+        it in the foreground with 'workers' forked processes, so
+        requests are handled on several cores. The 'evented' action
+        serves up to 'connections' concurrent connections from one
+        gevent event loop.
+
         Options:
-         - 'action' is one of [fg|start|stop|restart|status]
+         - 'action' is one of [fg|start|stop|restart|status|prefork|evented]
          - '--dry-run' print the paster command and exit
+         - '--host', '--port' used by 'prefork' and 'evented' only
+         - '--workers' used by 'prefork' only
+         - '--connections' used by 'evented' only
         """
-        _serve(action, debug=False, dry_run=dry_run)
+        if action == 'prefork':
+            _serve_prefork(host, port, workers, dry_run=dry_run)
+        elif action == 'evented':
+            _serve_evented(host, port, connections, dry_run=dry_run)
+        else:
+            _serve(action, debug=False, dry_run=dry_run)
 
     # bin/flask-ctl debug [fg|start|stop|restart|status]
     def action_debug(action=('a', 'start'), dry_run=False):
@@ -124,4 +243,33 @@ def run():
         """Stop the application."""
         _serve('stop', dry_run=dry_run)
 
+    # bin/flask-ctl precompute [--target=var/api] [--workers=0]
+    def action_precompute(target=('t', 'var/api'), workers=('w', 0)):
+        """Materialize all API responses to static files.
+
+        Writes plain and gzipped JSON of every /api/v1/ response, so
+        a front proxy can serve them without hitting the application.
+
+        Options:
+         - '--target' output directory, relative to buildout directory
+         - '--workers' size of a process pool, 0 renders in-process
+        """
+        precompute(target, workers=workers)
+
+    # bin/flask-ctl load_sqlite
+    def action_load_sqlite():
+        """Rebuild SQLite storage from the CSV file."""
+        load_sqlite()
+
+    # bin/flask-ctl benchmark [--users=100] [--days=250] [--repeat=5]
+    def action_benchmark(output=('o', 'var/benchmark.json'), users=('u', 100),
+                         days=('d', 250), repeat=('r', 5)):
+        """Benchmark loaders, aggregations and endpoints.
+
+        Generates a synthetic dataset of 'users' present on 'days'
+        working days and writes timings, throughput and peak memory
+        to 'output' as JSON, so runs can be compared.
+        """
+        benchmark(output, users, days, repeat)
+
     werkzeug.script.run()
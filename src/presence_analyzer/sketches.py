@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Mergeable fixed-bucket histograms of times of day.
+"""
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class Histogram(object):
+    """
+    Counts values (seconds since midnight) in fixed-width buckets.
+
+    Only non-empty buckets are stored, so a histogram never holds more
+    than SECONDS_PER_DAY / width counters no matter how many values were
+    added. Histograms of equal width can be merged, which gives the
+    distribution of a union of chunks or time ranges.
+    """
+
+    def __init__(self, width=60):
+        self.width = width
+        self.counts = {}
+        self.total = 0
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Histogram) and
+            self.width == other.width and
+            self.counts == other.counts
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<Histogram width={} total={}>'.format(self.width, self.total)
+
+    def copy(self):
+        """
+        Returns an independent histogram with the same counts.
+        """
+        result = Histogram(self.width)
+        result.counts = dict(self.counts)
+        result.total = self.total
+        return result
+
+    def add(self, value, count=1):
+        """
+        Adds value to the histogram. Negative count removes it.
+        """
+        bucket = min(max(value, 0), SECONDS_PER_DAY - 1) // self.width
+        current = self.counts.get(bucket, 0) + count
+        if current:
+            self.counts[bucket] = current
+        else:
+            self.counts.pop(bucket, None)
+        self.total += count
+
+    def merge(self, other):
+        """
+        Adds all values of other histogram to this one.
+        """
+        if other.width != self.width:
+            raise ValueError('Can not merge histograms of different widths')
+        for bucket, count in other.counts.iteritems():
+            current = self.counts.get(bucket, 0) + count
+            if current:
+                self.counts[bucket] = current
+            else:
+                self.counts.pop(bucket, None)
+        self.total += other.total
+        return self
+
+    def quantile(self, fraction):
+        """
+        Returns value below which given fraction of values lies,
+        as the middle of the bucket holding it. Returns zero
+        for an empty histogram.
+        """
+        if self.total <= 0:
+            return 0
+        rank = max(fraction * self.total, 1)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                break
+        return bucket * self.width + (self.width - 1) / 2.0
+
+    def buckets(self):
+        """
+        Returns sorted list of (bucket start, count) pairs.
+        """
+        return [
+            (bucket * self.width, count)
+            for bucket, count in sorted(self.counts.iteritems())
+        ]
+
+    def summary(self):
+        """
+        Returns median, 10th and 90th percentile and histogram.
+        """
+        return {
+            'median': self.quantile(0.5),
+            'p10': self.quantile(0.1),
+            'p90': self.quantile(0.9),
+            'histogram': self.buckets(),
+        }
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Startup preparation: template precompilation, dataset warm-up,
+readiness and timings.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+from main import app
+from utils import (
+    dataset_version,
+    get_data,
+    get_data_by_month,
+    get_rollup,
+    get_xml,
+)
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+TIMINGS = {}
+STATE = {'ready': False}
+TEMPLATES_LOCK = threading.Lock()
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+# added by flask_mako to every template, compiled modules contain it
+FLASK_IMPORTS = 'from flask.helpers import url_for, get_flashed_messages'
+
+
+@contextmanager
+def timed(name):
+    """
+    Stores duration of the block (in seconds) in TIMINGS under name.
+    """
+    started = time.time()
+    try:
+        yield
+    finally:
+        TIMINGS[name] = time.time() - started
+
+
+def init_templates():
+    """
+    Registers Mako templates in the app on first use, so mako is not
+    imported until a page is rendered or templates are precompiled.
+
+    MAKO_MODULE_DIRECTORY has to be set before, as the lookup created
+    on first render keeps it.
+    """
+    with TEMPLATES_LOCK:
+        if 'mako' not in getattr(app, 'extensions', {}):
+            from flask_mako import MakoTemplates
+            MakoTemplates(app)
+
+
+def precompile_templates():
+    """
+    Compiles all templates to Python modules up front.
+
+    Modules are written to MAKO_MODULE_DIRECTORY with the options
+    flask_mako uses, so they are reused by renders of this and next
+    processes. Without the directory templates are only checked to
+    compile. Returns names of compiled templates.
+    """
+    from mako.lookup import TemplateLookup  # deferred, mako is slow
+    init_templates()
+    config = app.config
+    lookup = TemplateLookup(
+        directories=[TEMPLATES_DIR],
+        module_directory=config['MAKO_MODULE_DIRECTORY'],
+        input_encoding=config['MAKO_INPUT_ENCODING'],
+        output_encoding=config['MAKO_OUTPUT_ENCODING'],
+        imports=list(config['MAKO_IMPORTS'] or []) + [FLASK_IMPORTS],
+        default_filters=config['MAKO_DEFAULT_FILTERS'],
+        preprocessor=config['MAKO_PREPROCESSOR'],
+        strict_undefined=config['MAKO_STRICT_UNDEFINED'],
+    )
+    names = sorted(
+        name for name in os.listdir(TEMPLATES_DIR) if name.endswith('.html')
+    )
+    for name in names:
+        lookup.get_template(name)
+    return names
+
+
+def warm_up():
+    """
+    Loads the dataset and every structure derived from it into cache.
+    """
+    get_data()
+    get_xml()
+    get_rollup()
+    get_data_by_month()
+
+
+def prepare():
+    """
+    Runs startup steps enabled in config and logs their timings.
+
+    PRECOMPILE_TEMPLATES compiles templates to MAKO_MODULE_DIRECTORY,
+    WARM_DATASET loads the dataset before the first request.
+    Marks the worker as ready when done.
+    """
+    if app.config.get('PRECOMPILE_TEMPLATES'):
+        with timed('precompile_templates'):
+            precompile_templates()
+    if app.config.get('WARM_DATASET'):
+        with timed('warm_dataset'):
+            warm_up()
+    log.info('Startup timings: %s', ', '.join(
+        '{} {:.3f}s'.format(name, value)
+        for name, value in sorted(TIMINGS.items())
+    ))
+    STATE['ready'] = True
+    return TIMINGS
+
+
+def readiness():
+    """
+    Returns readiness of the worker for a load balancer.
+
+    Worker is ready once prepare() has finished, that is after the
+    dataset is warmed up if WARM_DATASET is enabled.
+    """
+    return {
+        'ready': STATE['ready'],
+        'dataset_version': dataset_version(),
+    }
@@ -20,25 +20,22 @@
                 loading.show();
                 chart_div.hide();
                 user_img.hide();
-                user_img.attr('src', data_img[selected_user]);;
-                $.ajax({
-                    type: 'HEAD',
-                    url: "/api/v1/mean_time_weekday/" + selected_user,
-                    success: $.getJSON("/api/v1/presence_weekday/" + selected_user, function(result) {
-                        var data = google.visualization.arrayToDataTable(result),
-                            options = {};
-                        chart_div.show();
+                user_img.attr('src', data_img[selected_user]);
+                // one request returns all statistics of the user and is
+                // revalidated by the browser on other pages
+                $.getJSON("/api/v1/bundle/user/" + selected_user, function(bundle) {
+                    var data = google.visualization.arrayToDataTable(bundle.presence_weekday),
+                        options = {};
+                    chart_div.show();
+                    user_img.show();
+                    loading.hide();
+                    var chart = new google.visualization.PieChart(chart_div[0]);
+                    chart.draw(data, options);
+                }).fail(function() {
+                    loading.hide();
+                    if (selected_user != 0) {
+                        $('#user_no_data').show();
                         user_img.show();
-                        loading.hide();
-                        var chart = new google.visualization.PieChart(chart_div[0]);
-                        chart.draw(data, options);
-                    }),
-                    error: function() {
-                        loading.hide();
-                        if (selected_user != 0) {
-                            $('#user_no_data').show();
-                            user_img.show();
-                        }
                     }
                 });
             }
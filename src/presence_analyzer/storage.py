@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+"""
+Presence data storage backends.
+"""
+
+import csv
+import logging
+import os
+import threading
+
+from datetime import date as date_type, datetime, time as time_type
+
+import metrics
+
+log = logging.getLogger(__name__)  # pylint: disable=invalid-name
+
+DUPLICATE_POLICIES = ('last', 'first', 'merge', 'reject')
+MAX_REJECTED_LINES = 100
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS presence (
+        user_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        start INTEGER NOT NULL,
+        end INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS presence_user_date
+    ON presence (user_id, date)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS presence_year_month
+    ON presence (year, month)
+    """,
+)
+
+
+INSERT = (
+    'INSERT {} INTO presence (user_id, date, year, month, start, end) '
+    'VALUES (?, ?, ?, ?, ?, ?)'
+)
+
+
+def parse_row(row):
+    """
+    Converts a single CSV row to (user_id, date, start, end) tuple.
+
+    Raises ValueError or TypeError if row is malformed.
+    """
+    return (
+        int(row[0]),
+        datetime.strptime(row[1], '%Y-%m-%d').date(),
+        datetime.strptime(row[2], '%H:%M:%S').time(),
+        datetime.strptime(row[3], '%H:%M:%S').time(),
+    )
+
+
+def new_report(policy='last'):
+    """
+    Returns empty summary of a load with given duplicate policy.
+
+    Raises ValueError if policy is unknown.
+    """
+    if policy not in DUPLICATE_POLICIES:
+        raise ValueError('Unknown duplicate policy: {}'.format(policy))
+    return {
+        'policy': policy,
+        'accepted': 0,
+        'rejected': 0,
+        'duplicates': 0,
+        'rejected_lines': [],
+    }
+
+
+def reject_line(report, lineno):
+    """
+    Counts rejected line in report, remembering first
+    MAX_REJECTED_LINES line numbers.
+    """
+    report['rejected'] += 1
+    if lineno is not None and len(report['rejected_lines']) < \
+            MAX_REJECTED_LINES:
+        report['rejected_lines'].append(lineno)
+
+
+def resolve_duplicate(old, start, end, policy):
+    """
+    Returns (start, end) kept when a row repeats user and date of an
+    already loaded entry, or None if the new row is rejected.
+
+    'last' keeps the new row, 'first' keeps the old entry, 'merge' keeps
+    the earliest start and the latest end, 'reject' rejects the new row.
+    """
+    if policy == 'last':
+        return start, end
+    if policy == 'first':
+        return old['start'], old['end']
+    if policy == 'merge':
+        return min(old['start'], start), max(old['end'], end)
+    return None
+
+
+def group_rows(numbered_rows, policy='last', report=None):
+    """
+    Groups (line_number, (user_id, date, start, end)) pairs by user and
+    date, resolving repeated user and date with given duplicate policy.
+
+    Only rows which end up stored are counted as accepted, line numbers
+    (unless None) of duplicates rejected by the policy are remembered.
+
+    It creates structure like this:
+    data = {
+        10: {
+            datetime.date(2013, 10, 1): {
+                'start': datetime.time(9, 0, 0),
+                'end': datetime.time(17, 30, 0),
+            },
+        }
+    }
+    """
+    if report is None:
+        report = new_report(policy)
+    data = {}
+    for lineno, (user_id, date, start, end) in numbered_rows:
+        items = data.get(user_id)
+        if items is None:
+            items = data[user_id] = {}
+        old = items.get(date)
+        if old is not None:
+            report['duplicates'] += 1
+            kept = resolve_duplicate(old, start, end, policy)
+            if kept is None:
+                reject_line(report, lineno)
+                continue
+            start, end = kept
+        items[date] = {'start': start, 'end': end}
+    report['accepted'] += sum(len(items) for items in data.itervalues())
+    return data
+
+
+def read_csv(path, report=None):
+    """
+    Yields (line_number, row) pairs of valid presence rows of a CSV file.
+
+    Lines without exactly 4 columns or with malformed values are skipped
+    and counted in report, if it is given. Blank lines are ignored.
+    """
+    with open(path, 'r') as csvfile:
+        presence_reader = csv.reader(csvfile, delimiter=',')
+        for row in presence_reader:
+            try:
+                if len(row) != 4:
+                    if not row:
+                        continue
+                    raise ValueError(
+                        'Expected 4 columns, got {}'.format(len(row))
+                    )
+                yield presence_reader.line_num, parse_row(row)
+            except (ValueError, TypeError):
+                lineno = presence_reader.line_num
+                log.debug('Problem with line %d: ', lineno, exc_info=True)
+                metrics.inc('presence_rows_rejected_total', loader='csv')
+                if report is not None:
+                    reject_line(report, lineno)
+
+
+def _to_seconds(value):
+    """
+    Converts datetime.time to seconds since midnight.
+    """
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def _to_record(row):
+    """
+    Converts (user_id, date, start, end) row to values of presence
+    table columns.
+    """
+    user_id, date, start, end = row
+    return (
+        user_id,
+        date.isoformat(),
+        date.year,
+        date.month,
+        _to_seconds(start),
+        _to_seconds(end),
+    )
+
+
+def _from_seconds(value):
+    """
+    Converts seconds since midnight to datetime.time.
+    """
+    return time_type(value // 3600, value // 60 % 60, value % 60)
+
+
+def file_version(path):
+    """
+    Returns version of a file built from its modification time and size.
+
+    It changes whenever the file is written to and is the same for every
+    process reading the file.
+    """
+    stat = os.stat(path)
+    return '{:x}-{:x}'.format(int(stat.st_mtime * 1000000), stat.st_size)
+
+
+class CSVStorage(object):
+    """
+    Reads presence data with a full scan of a CSV file.
+    """
+    indexed = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def rows(self, report=None):
+        """
+        Yields all (user_id, date, start, end) rows. Malformed lines
+        are counted in report.
+        """
+        return (row for _, row in read_csv(self.path, report))
+
+    def numbered_rows(self, report=None):
+        """
+        Yields (line_number, row) pairs of all rows. Malformed lines
+        are counted in report.
+        """
+        return read_csv(self.path, report)
+
+    def user_rows(self, user_id):
+        """
+        Yields rows of given user.
+        """
+        return (row for row in self.rows() if row[0] == user_id)
+
+    def version(self):
+        """
+        Returns version of stored data.
+        """
+        return file_version(self.path)
+
+    def append(self, rows):
+        """
+        Appends (user_id, date, start, end) rows to the end of the file
+        and syncs it to disk. Returns number of appended rows.
+        """
+        count = 0
+        with open(self.path, 'ab+') as csvfile:
+            csvfile.seek(0, os.SEEK_END)
+            if csvfile.tell():
+                csvfile.seek(-1, os.SEEK_END)
+                if csvfile.read(1) != '\n':
+                    csvfile.write('\n')
+            writer = csv.writer(csvfile, lineterminator='\n')
+            for user_id, date, start, end in rows:
+                writer.writerow([
+                    user_id,
+                    date.isoformat(),
+                    start.strftime('%H:%M:%S'),
+                    end.strftime('%H:%M:%S'),
+                ])
+                count += 1
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+        return count
+
+
+class SQLiteStorage(object):
+    """
+    Keeps presence data in an indexed SQLite database.
+
+    Every thread gets its own connection, as sqlite3 connections
+    can not be shared between threads.
+    """
+    indexed = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.connection().executescript(';'.join(SCHEMA))
+
+    def connection(self):
+        """
+        Returns connection of the current thread, opening it if needed.
+        """
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            import sqlite3  # deferred, needed only by this backend
+            conn = self._local.connection = sqlite3.connect(self.path)
+        return conn
+
+    def version(self):
+        """
+        Returns version of stored data.
+        """
+        return file_version(self.path)
+
+    def is_empty(self):
+        """
+        Checks if there are no rows stored.
+        """
+        cursor = self.connection().execute('SELECT 1 FROM presence LIMIT 1')
+        return cursor.fetchone() is None
+
+    def insert(self, rows, batch_size=10000):
+        """
+        Inserts (user_id, date, start, end) rows in batched transactions.
+
+        Row of an already stored user and date replaces the old one.
+        Returns number of inserted rows.
+        """
+        conn = self.connection()
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(_to_record(row))
+            if len(batch) >= batch_size:
+                count += self._insert_batch(conn, batch)
+                batch = []
+        if batch:
+            count += self._insert_batch(conn, batch)
+        return count
+
+    @staticmethod
+    def _insert_batch(conn, batch):
+        """
+        Inserts a single batch in one transaction.
+        """
+        with conn:
+            conn.executemany(INSERT.format('OR REPLACE'), batch)
+        return len(batch)
+
+    def append(self, rows):
+        """
+        Stores (user_id, date, start, end) rows. Returns number of rows.
+        """
+        return self.insert(rows)
+
+    def load_csv(self, path, batch_size=10000, policy='last', report=None):
+        """
+        Replaces stored rows with the content of a CSV file.
+
+        Rows are inserted in batches as they are read, so the file is
+        never held in memory. Repeated user and date are resolved by
+        SQLite with given duplicate policy, malformed lines and
+        duplicates are counted in report. Returns number of stored rows.
+        """
+        if report is None:
+            report = new_report(policy)
+        conn = self.connection()
+        with conn:
+            conn.execute('DELETE FROM presence')
+        read = 0
+        batch = []
+        for lineno, row in read_csv(path, report):
+            batch.append((lineno, _to_record(row)))
+            if len(batch) >= batch_size:
+                read += self._load_batch(conn, batch, policy, report)
+                batch = []
+        if batch:
+            read += self._load_batch(conn, batch, policy, report)
+        count = conn.execute('SELECT COUNT(*) FROM presence').fetchone()[0]
+        report['accepted'] += count
+        report['duplicates'] += read - count
+        return count
+
+    @staticmethod
+    def _load_batch(conn, batch, policy, report):
+        """
+        Inserts a single batch of (line_number, record) pairs in one
+        transaction, resolving repeated user and date with given policy.
+        Returns number of rows in the batch.
+
+        'last' replaces stored rows, 'first' ignores new ones, 'merge'
+        widens stored rows to the earliest start and the latest end,
+        'reject' ignores new rows and counts their lines as rejected.
+        """
+        records = [record for _, record in batch]
+        with conn:
+            if policy == 'last':
+                conn.executemany(INSERT.format('OR REPLACE'), records)
+            elif policy == 'reject':
+                for lineno, record in batch:
+                    cursor = conn.execute(INSERT.format('OR IGNORE'), record)
+                    if not cursor.rowcount:
+                        reject_line(report, lineno)
+            else:
+                conn.executemany(INSERT.format('OR IGNORE'), records)
+                if policy == 'merge':
+                    conn.executemany(
+                        'UPDATE presence '
+                        'SET start = MIN(start, ?), end = MAX(end, ?) '
+                        'WHERE user_id = ? AND date = ?',
+                        [
+                            (start, end, user_id, date)
+                            for user_id, date, _, _, start, end in records
+                        ],
+                    )
+        return len(batch)
+
+    def _select(self, where='', params=()):
+        """
+        Yields (user_id, date, start, end) rows matching where clause.
+        """
+        cursor = self.connection().execute(
+            'SELECT user_id, date, start, end FROM presence {} '
+            'ORDER BY user_id, date'.format(where),
+            params,
+        )
+        for user_id, date, start, end in cursor:
+            yield (
+                user_id,
+                date_type(*[int(part) for part in date.split('-')]),
+                _from_seconds(start),
+                _from_seconds(end),
+            )
+
+    def rows(self, report=None):  # pylint: disable=unused-argument
+        """
+        Yields all (user_id, date, start, end) rows. Stored rows are
+        already validated and unique, so report is left untouched.
+        """
+        return self._select()
+
+    def numbered_rows(self, report=None):
+        """
+        Yields (None, row) pairs of all rows, stored rows have no
+        line numbers.
+        """
+        return ((None, row) for row in self.rows(report))
+
+    def user_rows(self, user_id):
+        """
+        Yields rows of given user using (user_id, date) index.
+        """
+        return self._select('WHERE user_id = ?', (user_id,))
+
+    def entry(self, user_id, date):
+        """
+        Returns row of given user and date, or None, using (user_id, date)
+        index.
+        """
+        return next(
+            self._select(
+                'WHERE user_id = ? AND date = ?', (user_id, date.isoformat()),
+            ),
+            None,
+        )
+
+    def records(self, user_id=None, since=None, until=None, after=None):
+        """
+        Yields rows ordered by user and date, optionally limited to
+        a user, dates between since and until (inclusive) and rows
+        following `after` (user_id, date) pair.
+        """
+        conditions = []
+        params = []
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            params.append(user_id)
+        if since is not None:
+            conditions.append('date >= ?')
+            params.append(since.isoformat())
+        if until is not None:
+            conditions.append('date <= ?')
+            params.append(until.isoformat())
+        if after is not None:
+            conditions.append('(user_id > ? OR (user_id = ? AND date > ?))')
+            params.extend([after[0], after[0], after[1].isoformat()])
+        where = ''
+        if conditions:
+            where = 'WHERE {}'.format(' AND '.join(conditions))
+        return self._select(where, params)
+
+    def month_totals(self, year, month):
+        """
+        Returns dict of seconds worked by every user in given month,
+        using (year, month) index.
+        """
+        cursor = self.connection().execute(
+            'SELECT user_id, SUM(end - start) FROM presence '
+            'WHERE year = ? AND month = ? GROUP BY user_id',
+            (year, month),
+        )
+        return dict(cursor.fetchall())
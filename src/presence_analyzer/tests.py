@@ -7,9 +7,35 @@ from __future__ import unicode_literals
 import os.path
 import json
 import datetime
+import gc
+import gzip
+import hashlib
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import types
 import unittest
+import urllib2
 
+import aggregates
+import anomalies
+import benchmark
+import cache
+import evented
+import export
+import helpers
+import ingest
 import main
+import metrics
+import occupancy
+import precompute
+import prefork
+import profiling
+import sketches
+import startup
+import storage
 import views
 import utils
 
@@ -45,13 +71,88 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
         pass
 
     def test_memoize(self):
+        key = utils.cache_key('get_data')
         utils.get_data()
-        self.assertTrue('expire' in utils.CACHE['get_data'])
-        self.assertTrue('data' in utils.CACHE['get_data'])
+        self.assertTrue('expire' in utils.CACHE[key])
+        self.assertTrue('data' in utils.CACHE[key])
         utils.CACHE.clear()
         utils.get_data()
-        self.assertTrue('expire' in utils.CACHE['get_data'])
-        self.assertTrue('data' in utils.CACHE['get_data'])
+        self.assertTrue('expire' in utils.CACHE[key])
+        self.assertTrue('data' in utils.CACHE[key])
+
+    def test_memoize_background_refresh(self):
+        """
+        Test returning expired value while refreshing it in a thread.
+        """
+        calls = []
+        release = threading.Event()
+        release.set()
+
+        @utils.memoize()
+        def refreshed():
+            """
+            Counts calls, blocks until released.
+            """
+            calls.append(1)
+            release.wait()
+            return len(calls)
+
+        main.app.config['CACHE_BACKGROUND_REFRESH'] = True
+        try:
+            key = utils.cache_key('refreshed')
+            self.assertEqual(refreshed(), 1)
+            utils.CACHE[key] = {
+                'expire': datetime.datetime.now(),
+                'data': 'stale',
+            }
+            release.clear()
+            self.assertEqual(refreshed(), 'stale')
+            thread = utils.refresh_in_background(key, None, 600)
+            self.assertIsNone(thread)
+            release.set()
+            for thread in threading.enumerate():
+                if thread.name == 'refresh-default-refreshed':
+                    thread.join()
+            self.assertEqual(refreshed(), 2)
+        finally:
+            release.set()
+            main.app.config.pop('CACHE_BACKGROUND_REFRESH')
+            utils.CACHE.clear()
+
+    def test_response_cache(self):
+        """
+        Test reusing encoded responses until dataset changes.
+        """
+        main.app.config['RESPONSE_CACHE'] = True
+        utils.ENCODED.clear()
+        try:
+            utils.get_data()
+            utils.get_xml()
+            resp = self.client.get('/api/v1/presence_weekday/10')
+            self.assertEqual(len(utils.ENCODED), 1)
+            key = utils.ENCODED.keys()[0]
+            body = utils.ENCODED[key]['data']
+            self.assertEqual(resp.data, body)
+            utils.ENCODED[key]['data'] = '"cached"'
+            resp = self.client.get('/api/v1/presence_weekday/10')
+            self.assertEqual(resp.data, '"cached"')
+            utils.dataset_state()['version'] = 'changed'
+            resp = self.client.get('/api/v1/presence_weekday/10')
+            self.assertEqual(resp.data, body)
+
+            # dataset reloaded during the request, body is not kept
+            utils.ENCODED.clear()
+            utils.dataset_state()['version'] = 'old'
+            utils.CACHE[utils.cache_key('get_data')]['expire'] = \
+                datetime.datetime.now()
+            resp = self.client.get('/api/v1/presence_weekday/10')
+            self.assertEqual(resp.data, body)
+            self.assertNotEqual(utils.dataset_version(), 'old')
+            self.assertEqual(len(utils.ENCODED), 0)
+        finally:
+            main.app.config.pop('RESPONSE_CACHE')
+            utils.ENCODED.clear()
+            utils.CACHE.clear()
 
     def test_mainpage(self):
         """
@@ -70,6 +171,55 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
         resp = self.client.get('/presence_start_end.html/')
         self.assertEqual(resp.status_code, 200)
 
+    def test_render_templates_cache(self):
+        """
+        Test reusing rendered pages and revalidating them with ETag.
+        """
+        main.app.config['TEMPLATE_CACHE'] = True
+        views.RENDERED.clear()
+        try:
+            resp = self.client.get('/presence_weekday.html/')
+            self.assertEqual(resp.headers['Cache-Control'], 'no-cache')
+            self.assertIn('presence_weekday.html', views.RENDERED)
+            views.RENDERED['presence_weekday.html'] = u'cached'
+            resp = self.client.get('/presence_weekday.html/')
+            self.assertEqual(resp.data, 'cached')
+            resp = self.client.get(
+                '/presence_weekday.html/',
+                headers={'If-None-Match': resp.headers['ETag']},
+            )
+            self.assertEqual(resp.status_code, 304)
+        finally:
+            main.app.config.pop('TEMPLATE_CACHE')
+            views.RENDERED.clear()
+
+    def test_static_url(self):
+        """
+        Test fingerprinting static files and caching them forever.
+        """
+        with main.app.test_request_context():
+            url = helpers.static_url('js/presence_weekday.js')
+        path = os.path.join(
+            main.app.static_folder, 'js', 'presence_weekday.js',
+        )
+        with open(path, 'rb') as asset:
+            digest = hashlib.md5(asset.read()).hexdigest()[:12]
+        self.assertEqual(
+            url, '/static/js/presence_weekday.js?v={}'.format(digest),
+        )
+        resp = self.client.get('/presence_weekday.html/')
+        self.assertIn(url, resp.data)
+
+        resp = self.client.get(url)
+        self.assertEqual(
+            resp.headers['Cache-Control'],
+            'public, max-age=31536000, immutable',
+        )
+        resp = self.client.get('/static/js/presence_weekday.js')
+        self.assertEqual(resp.headers['Cache-Control'], 'no-cache')
+        resp = self.client.get('/static/js/presence_weekday.js?v=foo')
+        self.assertEqual(resp.headers['Cache-Control'], 'no-cache')
+
     def test_years_view(self):
         """
         Test sorted years listing.
@@ -191,6 +341,95 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
         data = json.loads(resp.data)
         self.assertEqual(correct_data, data)
 
+    def test_top_employees_bundle_view(self):
+        """
+        Test returning years, months and rankings in one response.
+        """
+        resp = self.client.get('/api/v1/bundle/top_employees')
+        self.assertEqual(resp.status_code, 200)
+        data = json.loads(resp.data)
+        self.assertItemsEqual(data['years'].keys(), ['1999', '2013', '2014'])
+        self.assertEqual(
+            data['years']['2013']['months'], [['09', 'September']],
+        )
+        ranking = json.loads(
+            self.client.get('/api/v1/top_employees/2013/09/').data
+        )
+        self.assertEqual(data['years']['2013']['top']['09'], ranking)
+
+        resp = self.client.get('/api/v1/bundle/top_employees?top=1')
+        self.assertEqual(
+            json.loads(resp.data)['years']['2013']['top']['09'],
+            ranking[:1],
+        )
+        resp = self.client.get('/api/v1/bundle/top_employees?top=0')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_user_bundle_view(self):
+        """
+        Test returning all statistics of a user in one response.
+        """
+        resp = self.client.get('/api/v1/bundle/user/10')
+        self.assertEqual(resp.status_code, 200)
+        data = json.loads(resp.data)
+        for name in ('mean_time_weekday', 'presence_weekday',
+                     'presence_start_end'):
+            resp_single = self.client.get('/api/v1/{}/10'.format(name))
+            self.assertEqual(data[name], json.loads(resp_single.data))
+        resp = self.client.get('/api/v1/bundle/user/0')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_revalidate(self):
+        """
+        Test answering unchanged responses with 304 status.
+        """
+        resp = self.client.get('/api/v1/bundle/user/10')
+        self.assertEqual(resp.headers['Cache-Control'], 'no-cache')
+        etag = resp.headers['ETag']
+        resp = self.client.get(
+            '/api/v1/bundle/user/10', headers={'If-None-Match': etag},
+        )
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, '')
+        resp = self.client.get(
+            '/api/v1/bundle/user/11', headers={'If-None-Match': etag},
+        )
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            json.loads(resp.data)['version'], utils.served_version(),
+        )
+
+        # ETag follows data held in memory, not files on disk
+        utils.dataset_state()['version'] = 'changed'
+        try:
+            resp = self.client.get(
+                '/api/v1/bundle/user/10', headers={'If-None-Match': etag},
+            )
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+        finally:
+            utils.DATASET.clear()
+            utils.CACHE.clear()
+
+    def test_revalidate_not_loaded(self):
+        """
+        Test ETag is a hash of the body when data was not loaded before.
+        """
+        utils.DATASET.clear()
+        utils.CACHE.clear()
+        resp = self.client.get('/api/v1/bundle/top_employees')
+        self.assertEqual(
+            resp.headers['ETag'],
+            '"{}"'.format(hashlib.sha1(resp.data).hexdigest()),
+        )
+        utils.DATASET.clear()
+        utils.CACHE.clear()
+        resp = self.client.get(
+            '/api/v1/bundle/top_employees',
+            headers={'If-None-Match': resp.headers['ETag']},
+        )
+        self.assertEqual(resp.status_code, 304)
+
 
 class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
     """
@@ -238,6 +477,56 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         }
         self.assertEqual(data['Marcin P.'], correct_data)
 
+    def test_get_rollup(self):
+        """
+        Test pre-aggregating data by year, month and user.
+        """
+        data = utils.get_rollup()
+        self.assertItemsEqual(data.keys(), ['1999', '2013', '2014'])
+        stats = data['2013']['09'][10]
+        self.assertEqual(stats['worked_seconds'], 78217)
+        self.assertEqual(stats['days'], 3)
+        self.assertEqual(stats['weekdays'][1]['worked_seconds'], 30047)
+        self.assertEqual(stats['weekdays'][0]['days'], 0)
+        mean_start, mean_end = utils.rollup_means(stats)
+        self.assertAlmostEqual(mean_start, 35754.33, places=2)
+        self.assertAlmostEqual(mean_end, 61826.67, places=2)
+        self.assertEqual(utils.rollup_means(stats['weekdays'][0]), (0, 0))
+
+    def test_user_weekday_rollup(self):
+        """
+        Test summing rollup cells of a user per weekday over all months.
+        """
+        weekdays = utils.user_weekday_rollup(10)
+        self.assertEqual(len(weekdays), 7)
+        self.assertEqual(weekdays[0]['days'], 0)
+        times = utils.start_end_time(utils.get_data()[10])
+        for weekday, stats in enumerate(weekdays):
+            self.assertEqual(stats['days'], len(times[weekday]['start']))
+            self.assertEqual(
+                stats['start_seconds'], sum(times[weekday]['start']),
+            )
+            self.assertEqual(stats['end_seconds'], sum(times[weekday]['end']))
+        self.assertEqual(utils.user_weekday_rollup(0)[1]['days'], 0)
+
+    def test_update_rollup(self):
+        """
+        Test adding presence entries to the rollup cube incrementally.
+        """
+        cube = {}
+        utils.update_rollup(
+            cube, 10, datetime.date(2013, 9, 9),
+            datetime.time(9, 0, 0), datetime.time(17, 0, 0),
+        )
+        utils.update_rollup(
+            cube, 10, datetime.date(2013, 9, 16),
+            datetime.time(8, 0, 0), datetime.time(16, 0, 0),
+        )
+        stats = cube['2013']['09'][10]
+        self.assertEqual(stats['worked_seconds'], 57600)
+        self.assertEqual(stats['weekdays'][0]['days'], 2)
+        self.assertEqual(utils.rollup_means(stats), (30600.0, 59400.0))
+
     def test_get_data(self):
         """
         Test parsing of CSV file.
@@ -327,6 +616,1768 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
         self.assertEqual(correct_data, utils.start_end_time(data[10]))
 
 
+class PresenceAnalyzerPrecomputeTestCase(unittest.TestCase):
+    """
+    Precomputing static API responses tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        self.target = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        shutil.rmtree(self.target)
+
+    def test_api_urls(self):
+        """
+        Test listing all API urls of a dataset.
+        """
+        urls = precompute.api_urls()
+        self.assertIn('/api/v1/years', urls)
+        self.assertIn('/api/v1/top_employees/2013/', urls)
+        self.assertIn('/api/v1/top_employees/2013/09/', urls)
+        self.assertIn('/api/v1/presence_start_end/5123', urls)
+        self.assertIn('/api/v1/occupancy/weekday', urls)
+        self.assertEqual(len(urls), 8 + 3 * 2 + 5 * 6)
+
+    def test_url_to_path(self):
+        """
+        Test mapping urls to file paths.
+        """
+        self.assertEqual(
+            precompute.url_to_path('/tmp', '/api/v1/years'),
+            '/tmp/api/v1/years.json',
+        )
+        self.assertEqual(
+            precompute.url_to_path('/tmp', '/api/v1/top_employees/2013/'),
+            '/tmp/api/v1/top_employees/2013/index.json',
+        )
+
+    def test_precompute(self):
+        """
+        Test writing plain and gzipped responses.
+        """
+        paths = precompute.precompute(self.target)
+        self.assertEqual(len(paths), len(precompute.api_urls()))
+        path = os.path.join(self.target, 'api', 'v1', 'years.json')
+        with open(path) as infile:
+            self.assertEqual(json.load(infile), ['1999', '2013', '2014'])
+        gzfile = gzip.open(path + '.gz')
+        try:
+            self.assertEqual(json.load(gzfile), ['1999', '2013', '2014'])
+        finally:
+            gzfile.close()
+
+    def test_precompute_parallel(self):
+        """
+        Test writing responses with a process pool.
+        """
+        paths = precompute.precompute(self.target, workers=2)
+        self.assertItemsEqual(
+            paths,
+            [
+                precompute.url_to_path(self.target, url)
+                for url in precompute.api_urls()
+            ],
+        )
+
+
+class PresenceAnalyzerStorageTestCase(unittest.TestCase):
+    """
+    Storage backends tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML,
+            'DATA_SQLITE': os.path.join(self.tmpdir, 'presence.sqlite'),
+            'STORAGE': 'sqlite',
+        })
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.pop('STORAGE')
+        utils.STORAGES.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse_row(self):
+        """
+        Test parsing a single CSV row.
+        """
+        self.assertEqual(
+            storage.parse_row(['10', '2013-09-10', '09:39:05', '17:59:52']),
+            (
+                10,
+                datetime.date(2013, 9, 10),
+                datetime.time(9, 39, 5),
+                datetime.time(17, 59, 52),
+            ),
+        )
+        with self.assertRaises(ValueError):
+            storage.parse_row(['10', '2013-13-10', '09:39:05', '17:59:52'])
+
+    def write_csv(self, content):
+        """
+        Writes CSV file to temporary directory and returns its path.
+        """
+        path = os.path.join(self.tmpdir, 'data.csv')
+        with open(path, 'w') as outfile:
+            outfile.write(content)
+        return path
+
+    def test_group_rows(self):
+        """
+        Test rejecting malformed lines and resolving duplicates.
+        """
+        path = self.write_csv(
+            'user_id,date,start,end\n'
+            '10,2013-09-10,09:00:00,17:00:00\n'
+            '\n'
+            '10,2013-09-10,08:00:00,16:00:00\n'
+            '10,2013-09-11,09:00\n'
+        )
+        expected = [
+            ('last', datetime.time(8, 0, 0), datetime.time(16, 0, 0)),
+            ('first', datetime.time(9, 0, 0), datetime.time(17, 0, 0)),
+            ('merge', datetime.time(8, 0, 0), datetime.time(17, 0, 0)),
+            ('reject', datetime.time(9, 0, 0), datetime.time(17, 0, 0)),
+        ]
+        for policy, start, end in expected:
+            report = storage.new_report(policy)
+            data = storage.group_rows(
+                storage.read_csv(path, report), policy, report,
+            )
+            self.assertEqual(data, {
+                10: {
+                    datetime.date(2013, 9, 10): {'start': start, 'end': end},
+                },
+            })
+            self.assertEqual(report['duplicates'], 1)
+            self.assertEqual(report['accepted'], 1)
+        self.assertEqual(report['rejected_lines'], [1, 4, 5])
+        self.assertEqual(report['rejected'], 3)
+        report = storage.new_report('last')
+        storage.group_rows(storage.read_csv(path, report), 'last', report)
+        self.assertEqual(report['rejected_lines'], [1, 5])
+        self.assertEqual(report['rejected'], 2)
+        with self.assertRaises(ValueError):
+            storage.new_report('foo')
+
+    def test_sqlite_load_csv(self):
+        """
+        Test resolving duplicates when loading the database.
+        """
+        path = self.write_csv(
+            '10,2013-09-10,09:00:00,17:00:00\n'
+            '10,2013-09-10,08:00:00,16:00:00\n'
+        )
+        report = storage.new_report('first')
+        sqlite = storage.SQLiteStorage(main.app.config['DATA_SQLITE'])
+        self.assertEqual(
+            sqlite.load_csv(path, policy='first', report=report), 1,
+        )
+        self.assertEqual(list(sqlite.rows()), [(
+            10,
+            datetime.date(2013, 9, 10),
+            datetime.time(9, 0, 0),
+            datetime.time(17, 0, 0),
+        )])
+        self.assertEqual(report['duplicates'], 1)
+
+        path = self.write_csv(
+            '10,2013-09-10,09:00:00,17:00:00\n'
+            '11,2013-09-10,09:00:00,17:00:00\n'
+            'bad,row\n'
+            '10,2013-09-10,08:00:00,16:00:00\n'
+            '10,2013-09-10,10:00:00,18:00:00\n'
+        )
+        for policy in storage.DUPLICATE_POLICIES:
+            expected = storage.new_report(policy)
+            data = storage.group_rows(
+                storage.read_csv(path, expected), policy, expected,
+            )
+            report = storage.new_report(policy)
+            self.assertEqual(
+                sqlite.load_csv(
+                    path, batch_size=2, policy=policy, report=report,
+                ),
+                2,
+            )
+            self.assertEqual(report, expected)
+            self.assertEqual(list(sqlite.rows()), [
+                (user_id, date, item['start'], item['end'])
+                for user_id, items in sorted(data.items())
+                for date, item in items.items()
+            ])
+
+    def test_load_report_view(self):
+        """
+        Test exposing summary of the last load.
+        """
+        resp = self.client.get('/api/v1/load_report')
+        self.assertEqual(json.loads(resp.data), {
+            'policy': 'last',
+            'accepted': 18,
+            'rejected': 0,
+            'duplicates': 0,
+            'rejected_lines': [],
+        })
+
+    def test_get_storage(self):
+        """
+        Test selecting storage backend.
+        """
+        self.assertIsInstance(utils.get_storage(), storage.SQLiteStorage)
+        main.app.config['STORAGE'] = 'csv'
+        self.assertIsInstance(utils.get_storage(), storage.CSVStorage)
+        main.app.config['STORAGE'] = 'foo'
+        with self.assertRaises(ValueError):
+            utils.get_storage()
+
+    def test_sqlite_rows(self):
+        """
+        Test SQLite backend returns the same rows as CSV file.
+        """
+        csv_rows = list(storage.CSVStorage(TEST_DATA_CSV).rows())
+        sqlite_rows = list(utils.get_storage().rows())
+        self.assertItemsEqual(sqlite_rows, csv_rows)
+        self.assertEqual(
+            list(utils.get_storage().user_rows(10)),
+            [row for row in csv_rows if row[0] == 10],
+        )
+        self.assertEqual(
+            utils.get_entry(10, datetime.date(2013, 9, 10)),
+            {
+                'start': datetime.time(9, 39, 5),
+                'end': datetime.time(17, 59, 52),
+            },
+        )
+        self.assertIsNone(utils.get_entry(10, datetime.date(2000, 1, 1)))
+
+    def test_sqlite_month_totals(self):
+        """
+        Test summing worked seconds in the database.
+        """
+        totals = utils.get_storage().month_totals(2013, 9)
+        self.assertEqual(totals[10], 78217)
+        self.assertEqual(len(totals), 3)
+        self.assertEqual(utils.get_storage().month_totals(1900, 1), {})
+
+    def test_sqlite_records(self):
+        """
+        Test filtering records in the database.
+        """
+        records = list(utils.get_storage().records(
+            since=datetime.date(2013, 9, 11),
+            until=datetime.date(2013, 9, 12),
+            after=(10, datetime.date(2013, 9, 11)),
+        ))
+        self.assertEqual(
+            [(record[0], record[1].day) for record in records],
+            [(10, 12), (11, 11), (11, 12), (5123, 11), (5123, 12)],
+        )
+        self.assertEqual(len(list(utils.get_storage().records(user_id=13))), 3)
+
+    def test_sqlite_views(self):
+        """
+        Test views backed by SQLite storage.
+        """
+        resp = self.client.get('/api/v1/presence_weekday/10')
+        self.assertEqual(json.loads(resp.data)[2], ['Tue', 30047])
+        resp = self.client.get('/api/v1/presence_weekday/0')
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get('/api/v1/top_employees/2013/09/')
+        self.assertEqual(json.loads(resp.data)[0][0], 'Marcin J.')
+        resp = self.client.get('/api/v1/top_employees/1900/19/')
+        self.assertEqual(resp.status_code, 404)
+
+
+class PresenceAnalyzerIngestTestCase(unittest.TestCase):
+    """
+    Ingesting new presence rows tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        self.data_csv = os.path.join(self.tmpdir, 'data.csv')
+        shutil.copy(TEST_DATA_CSV, self.data_csv)
+        main.app.config.update({
+            'DATA_CSV': self.data_csv,
+            'DATA_XML': TEST_DATA_XML,
+            'INGEST_TOKEN': 'secret',
+        })
+        utils.CACHE.clear()
+        utils.STORAGES.clear()
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.pop('INGEST_TOKEN')
+        utils.CACHE.clear()
+        utils.STORAGES.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def post(self, data, content_type='text/csv', token='secret'):
+        """
+        Posts rows to ingest endpoint.
+        """
+        return self.client.post(
+            '/api/v1/ingest',
+            data=data,
+            content_type=content_type,
+            headers={'Authorization': 'Token {}'.format(token)},
+        )
+
+    def test_parse_csv_lines(self):
+        """
+        Test parsing CSV lines.
+        """
+        parsed = list(ingest.parse_csv_lines([
+            '10,2013-09-16,09:00:00,17:00:00\n',
+            '\n',
+            '10,2013-09-17,09:00:00\n',
+        ]))
+        self.assertEqual(parsed[0][0], 1)
+        self.assertEqual(parsed[0][1][1], datetime.date(2013, 9, 16))
+        self.assertEqual(parsed[1], (3, None))
+
+    def test_parse_ndjson_lines(self):
+        """
+        Test parsing newline delimited JSON lines.
+        """
+        parsed = list(ingest.parse_ndjson_lines([
+            '{"user_id": 10, "date": "2013-09-16", '
+            '"start": "09:00:00", "end": "17:00:00"}\n',
+            '{"user_id": 10}\n',
+            'foo\n',
+        ]))
+        self.assertEqual(parsed[0][1][0], 10)
+        self.assertEqual(parsed[1], (2, None))
+        self.assertEqual(parsed[2], (3, None))
+
+    def test_ingest_view_auth(self):
+        """
+        Test ingest endpoint requires a token.
+        """
+        resp = self.post('', token='wrong')
+        self.assertEqual(resp.status_code, 401)
+        resp = self.post('', token='sécret')
+        self.assertEqual(resp.status_code, 401)
+        resp = self.post('', content_type='text/plain')
+        self.assertEqual(resp.status_code, 415)
+        main.app.config['INGEST_TOKEN'] = None
+        resp = self.post('', token='None')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_ingest_view(self):
+        """
+        Test ingested rows update caches and are stored durably.
+        """
+        utils.get_data()
+        utils.get_rollup()
+        resp = self.post(
+            '10,2013-09-16,09:00:00,17:00:00\n'
+            '10,2013-09-10,09:00:00,10:00:00\n'
+            'bad,row\n'
+        )
+        self.assertEqual(resp.status_code, 200)
+        summary = json.loads(resp.data)
+        self.assertEqual(summary['accepted'], 2)
+        self.assertEqual(summary['rejected'], 1)
+        self.assertEqual(summary['rejected_lines'], [3])
+
+        stats = utils.get_rollup()['2013']['09'][10]
+        self.assertEqual(stats['days'], 4)
+        self.assertEqual(stats['worked_seconds'], 78217 - 30047 + 3600 * 9)
+        self.assertEqual(stats['weekdays'][1]['worked_seconds'], 3600)
+        self.assertEqual(
+            utils.get_data()[10][datetime.date(2013, 9, 16)]['start'],
+            datetime.time(9, 0, 0),
+        )
+        resp = self.client.get('/api/v1/top_employees/2013/09/')
+        self.assertEqual(
+            dict(json.loads(resp.data))['Jacek K.']['worked_hours'],
+            (78217 - 30047 + 3600 * 9) / 3600.0,
+        )
+
+        self.assertEqual(
+            utils.dataset_version(), storage.file_version(self.data_csv),
+        )
+        utils.CACHE.clear()
+        self.assertEqual(utils.get_rollup()['2013']['09'][10], stats)
+
+    def test_ingest_duplicate_policy(self):
+        """
+        Test resolving ingested rows repeating stored entries.
+        """
+        main.app.config['DUPLICATE_POLICY'] = 'reject'
+        try:
+            resp = self.post(
+                '10,2013-09-16,09:00:00,17:00:00\n'
+                '10,2013-09-10,09:00:00,10:00:00\n'
+                '10,2013-09-16,08:00:00,17:00:00\n'
+            )
+        finally:
+            main.app.config.pop('DUPLICATE_POLICY')
+        summary = json.loads(resp.data)
+        self.assertEqual(summary['accepted'], 1)
+        self.assertEqual(summary['duplicates'], 2)
+        self.assertEqual(summary['rejected_lines'], [2, 3])
+        self.assertEqual(
+            utils.get_data()[10][datetime.date(2013, 9, 10)]['end'],
+            datetime.time(17, 59, 52),
+        )
+
+        main.app.config['DUPLICATE_POLICY'] = 'merge'
+        try:
+            resp = self.post('10,2013-09-16,08:00:00,16:00:00\n')
+        finally:
+            main.app.config.pop('DUPLICATE_POLICY')
+        utils.CACHE.clear()
+        self.assertEqual(
+            utils.get_data()[10][datetime.date(2013, 9, 16)],
+            {'start': datetime.time(8, 0, 0), 'end': datetime.time(17, 0, 0)},
+        )
+
+    def test_ingest_concurrent_readers(self):
+        """
+        Test reading cached data while rows of the same user are ingested.
+        """
+        utils.get_data()
+        utils.get_rollup()
+        errors = []
+        done = threading.Event()
+
+        def read():
+            """
+            Walks user data and rollup cube until ingest is done.
+            """
+            while not done.is_set():
+                try:
+                    utils.group_by_weekday(utils.get_data()[10])
+                    for months in utils.get_rollup().values():
+                        for users in months.values():
+                            for stats in users.values():
+                                stats['weekdays'][0]['start_sketch'].buckets()
+                except Exception as exc:  # pylint: disable=broad-except
+                    errors.append(exc)
+                    return
+
+        thread = threading.Thread(target=read)
+        thread.start()
+        try:
+            for year in range(2000, 2010):
+                self.post(''.join(
+                    '10,{},09:00:00,17:00:00\n'.format(
+                        datetime.date(year, 1, 1) +
+                        datetime.timedelta(days=day)
+                    )
+                    for day in range(300)
+                ))
+        finally:
+            done.set()
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(utils.get_data()[10]), 3 + 10 * 300)
+        self.assertEqual(utils.get_rollup()['2005']['01'][10]['days'], 31)
+
+    def test_ingest_view_ndjson(self):
+        """
+        Test ingesting newline delimited JSON without loaded caches.
+        """
+        resp = self.post(
+            '{"user_id": 99, "date": "2014-01-02", '
+            '"start": "08:00:00", "end": "16:00:00"}\n',
+            content_type='application/x-ndjson',
+        )
+        self.assertEqual(json.loads(resp.data)['accepted'], 1)
+        self.assertIn(99, utils.get_data())
+
+
+class PresenceAnalyzerBenchmarkTestCase(unittest.TestCase):
+    """
+    Benchmark suite tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.pop('STORAGE', None)
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        utils.CACHE.clear()
+        utils.STORAGES.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def test_generate_dataset(self):
+        """
+        Test generating synthetic data files.
+        """
+        csv_path, xml_path, rows = benchmark.generate_dataset(
+            self.tmpdir, users=3, days=10,
+        )
+        main.app.config.update({
+            'DATA_CSV': csv_path,
+            'DATA_XML': xml_path,
+            'STORAGE': 'csv',
+        })
+        utils.CACHE.clear()
+        data = utils.get_data()
+        self.assertItemsEqual(data.keys(), [10, 11, 12])
+        self.assertEqual(sum(len(items) for items in data.values()), rows)
+        self.assertEqual(utils.get_xml()['12']['name'], 'User 12.')
+
+    def test_percentile(self):
+        """
+        Test nearest-rank percentile.
+        """
+        samples = range(1, 101)
+        self.assertEqual(benchmark.percentile(samples, 50), 50)
+        self.assertEqual(benchmark.percentile(samples, 99), 99)
+        self.assertEqual(benchmark.percentile([5], 10), 5)
+
+    def test_benchmark(self):
+        """
+        Test benchmarking a generated dataset.
+        """
+        csv_path, xml_path, _ = benchmark.generate_dataset(
+            self.tmpdir, users=3, days=10,
+        )
+        main.app.config.pop('STORAGE', None)
+        main.app.config['DATA_CSV'] = TEST_DATA_CSV
+        report = benchmark.benchmark(csv_path, xml_path, repeat=2)
+        self.assertIn('get_data', report['results'])
+        self.assertIn('/api/v1/presence_weekday/<user_id>', report['results'])
+        self.assertEqual(report['results']['get_xml']['runs'], 2)
+        self.assertGreaterEqual(
+            report['results']['get_data']['peak_memory_increase_kb'], 0,
+        )
+        self.assertEqual(report['users'], 3)
+        self.assertEqual(main.app.config['DATA_CSV'], TEST_DATA_CSV)
+        self.assertNotIn('STORAGE', main.app.config)
+
+    def test_run_isolated(self):
+        """
+        Test running a function in a forked process.
+        """
+        utils.CACHE.clear()
+        self.assertEqual(
+            benchmark.run_isolated(lambda: len(utils.get_data())), 5,
+        )
+        self.assertNotIn(utils.cache_key('get_data'), utils.CACHE)
+        self.assertRaises(RuntimeError, benchmark.run_isolated, lambda: 1 / 0)
+
+
+class PresenceAnalyzerMetricsTestCase(unittest.TestCase):
+    """
+    Metrics tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML,
+            'METRICS_ENABLED': True,
+        })
+        metrics.reset()
+        utils.CACHE.clear()
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config.pop('METRICS_ENABLED')
+        metrics.reset()
+
+    def test_counters(self):
+        """
+        Test counting values.
+        """
+        metrics.inc('foo_total', function='bar')
+        metrics.inc('foo_total', 2, function='bar')
+        self.assertIn('foo_total{function="bar"} 3\n', metrics.render())
+        main.app.config['METRICS_ENABLED'] = False
+        metrics.inc('foo_total', function='bar')
+        self.assertIn('foo_total{function="bar"} 3\n', metrics.render())
+
+    def test_histograms(self):
+        """
+        Test recording values in buckets.
+        """
+        metrics.observe('foo_seconds', 0.007)
+        metrics.observe('foo_seconds', 20)
+        text = metrics.render()
+        self.assertIn('# TYPE foo_seconds histogram', text)
+        self.assertIn('foo_seconds_bucket{le="0.005"} 0', text)
+        self.assertIn('foo_seconds_bucket{le="0.01"} 1', text)
+        self.assertIn('foo_seconds_bucket{le="+Inf"} 2', text)
+        self.assertIn('foo_seconds_count 2', text)
+
+    def test_metrics_view(self):
+        """
+        Test exposing hot path metrics.
+        """
+        self.client.get('/api/v1/presence_weekday/10')
+        self.client.get('/api/v1/presence_weekday/11')
+        resp = self.client.get('/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/plain')
+        self.assertIn(
+            'presence_cache_misses_total{function="get_data"} 1', resp.data,
+        )
+        self.assertRegexpMatches(
+            resp.data, r'presence_cache_hits_total\{function="get_data"\} \d',
+        )
+        self.assertIn(
+            'presence_rows_parsed_total{loader="get_data"} 18', resp.data,
+        )
+        self.assertIn(
+            'presence_request_seconds_count'
+            '{endpoint="presence_weekday_view",status="200"} 2',
+            resp.data,
+        )
+        self.assertIn(
+            'presence_serialization_seconds_count'
+            '{endpoint="presence_weekday_view"} 2',
+            resp.data,
+        )
+        main.app.config['METRICS_ENABLED'] = False
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+class PresenceAnalyzerProfilingTestCase(unittest.TestCase):
+    """
+    Profiling middleware tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        self.tmpdir = tempfile.mkdtemp()
+        self.wsgi_app = main.app.wsgi_app
+        self.profiler = main.app.wsgi_app = profiling.ProfilerMiddleware(
+            main.app.wsgi_app, main.app.url_map, self.tmpdir,
+            secret='s3cret',
+        )
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.wsgi_app = self.wsgi_app
+        shutil.rmtree(self.tmpdir)
+
+    def test_not_profiled(self):
+        """
+        Test requests are not profiled by default.
+        """
+        resp = self.client.get('/api/v1/presence_weekday/10')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_profiled_with_header(self):
+        """
+        Test profiling requests carrying the debug header.
+        """
+        resp = self.client.get(
+            '/api/v1/presence_weekday/10', headers={'X-Profile': 's3cret'},
+        )
+        self.assertEqual(json.loads(resp.data)[2], ['Tue', 30047])
+        resp = self.client.get('/foo/bar', headers={'X-Profile': 's3cret'})
+        self.assertEqual(resp.status_code, 404)
+        self.client.get('/api/v1/users', headers={'X-Profile': 'wrong'})
+        self.client.get('/api/v1/users', headers={'X-Profile': 'sécret'})
+        self.assertItemsEqual(
+            os.listdir(self.tmpdir), ['presence_weekday_view', 'unmatched'],
+        )
+        directory = os.path.join(self.tmpdir, 'presence_weekday_view')
+        self.assertTrue(os.listdir(directory)[0].endswith('.prof'))
+
+    def test_sampled(self):
+        """
+        Test profiling a sampled fraction of requests.
+        """
+        self.profiler.sample_rate = 1.0
+        self.client.get('/api/v1/users')
+        self.assertEqual(os.listdir(self.tmpdir), ['users_view'])
+
+    def test_header_needs_secret(self):
+        """
+        Test the debug header is ignored when no secret is configured.
+        """
+        self.profiler.secret = None
+        self.client.get('/api/v1/users', headers={'X-Profile': '1'})
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_max_dumps(self):
+        """
+        Test profiling stops after max_dumps profiles.
+        """
+        self.profiler.sample_rate = 1.0
+        self.profiler.max_dumps = 2
+        for _ in range(3):
+            self.client.get('/api/v1/users')
+        directory = os.path.join(self.tmpdir, 'users_view')
+        self.assertEqual(len(os.listdir(directory)), 2)
+
+
+class PresenceAnalyzerStartupTestCase(unittest.TestCase):
+    """
+    Startup preparation tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        self.tmpdir = tempfile.mkdtemp()
+        utils.CACHE.clear()
+        utils.DATASET.clear()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        main.app.config['MAKO_MODULE_DIRECTORY'] = None
+        main.app._mako_lookup = None  # pylint: disable=protected-access
+        for name in ('PRECOMPILE_TEMPLATES', 'WARM_DATASET'):
+            main.app.config.pop(name, None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_precompile_templates(self):
+        """
+        Test compiling templates to a module directory.
+        """
+        main.app.config['MAKO_MODULE_DIRECTORY'] = self.tmpdir
+        names = startup.precompile_templates()
+        self.assertIn('base.html', names)
+        self.assertIn('base.html.py', os.listdir(self.tmpdir))
+        modified = os.path.getmtime(os.path.join(self.tmpdir, 'base.html.py'))
+        resp = main.app.test_client().get('/presence_start_end.html/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            os.path.getmtime(os.path.join(self.tmpdir, 'base.html.py')),
+            modified,
+        )
+
+    def test_ready_view(self):
+        """
+        Test reporting readiness and dataset version.
+        """
+        client = main.app.test_client()
+        startup.STATE['ready'] = False
+        resp = client.get('/health/ready')
+        self.assertEqual(resp.status_code, 503)
+        self.assertFalse(json.loads(resp.data)['ready'])
+
+        startup.prepare()
+        resp = client.get('/health/ready')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data), {
+            'ready': True,
+            'dataset_version': None,
+        })
+        utils.get_data()
+        resp = client.get('/health/ready')
+        self.assertEqual(
+            json.loads(resp.data)['dataset_version'],
+            storage.file_version(TEST_DATA_CSV),
+        )
+
+    def test_prepare(self):
+        """
+        Test running enabled startup steps.
+        """
+        main.app.config.update({
+            'MAKO_MODULE_DIRECTORY': self.tmpdir,
+            'PRECOMPILE_TEMPLATES': True,
+            'WARM_DATASET': True,
+        })
+        timings = startup.prepare()
+        self.assertIn('precompile_templates', timings)
+        self.assertIn('warm_dataset', timings)
+        self.assertItemsEqual(
+            utils.CACHE.keys(),
+            [
+                utils.cache_key(name)
+                for name in ('get_data', 'get_xml', 'get_rollup',
+                             'get_data_by_month')
+            ],
+        )
+
+
+class PresenceAnalyzerPreforkTestCase(unittest.TestCase):
+    """
+    Pre-fork server tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        utils.CACHE.clear()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        utils.CACHE.clear()
+
+    def test_freeze_dataset(self):
+        """
+        Test loading dataset before forking.
+        """
+        prefork.freeze_dataset()
+        self.assertIn(utils.cache_key('get_data'), utils.CACHE)
+        self.assertIn(utils.cache_key('get_data_by_month'), utils.CACHE)
+        self.assertIsNone(utils.CACHE[utils.cache_key('get_data')]['expire'])
+        self.assertIsNone(utils.CACHE[utils.cache_key('get_xml')]['expire'])
+
+    def test_reload_changed(self):
+        """
+        Test reloading pinned dataset after its file changed.
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            data_csv = os.path.join(tmpdir, 'data.csv')
+            shutil.copy(TEST_DATA_CSV, data_csv)
+            main.app.config['DATA_CSV'] = data_csv
+            prefork.freeze_dataset()
+            self.assertFalse(prefork.reload_changed())
+            with open(data_csv, 'a') as outfile:
+                outfile.write('99,2014-01-02,08:00:00,16:00:00\n')
+            self.assertTrue(prefork.reload_changed())
+            self.assertIn(99, utils.get_data())
+            self.assertEqual(
+                utils.dataset_version(), storage.file_version(data_csv),
+            )
+            self.assertIsNone(
+                utils.CACHE[utils.cache_key('get_data')]['expire'],
+            )
+            self.assertFalse(prefork.reload_changed())
+        finally:
+            main.app.config['DATA_CSV'] = TEST_DATA_CSV
+            utils.STORAGES.clear()
+            shutil.rmtree(tmpdir)
+
+    def test_tune_worker_gc(self):
+        """
+        Test raising collector thresholds in workers.
+        """
+        thresholds = gc.get_threshold()
+        try:
+            prefork.tune_worker_gc()
+            if not hasattr(gc, 'freeze'):
+                self.assertEqual(
+                    gc.get_threshold(), prefork.WORKER_GC_THRESHOLDS,
+                )
+        finally:
+            gc.set_threshold(*thresholds)
+
+    def test_run_workers(self):
+        """
+        Test serving requests with forked workers.
+        """
+        prefork.freeze_dataset()
+        server = prefork.make_server('127.0.0.1', 0, main.app)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                prefork.run_workers(server, 2)
+            finally:
+                os._exit(0)  # pylint: disable=protected-access
+        server.server_close()
+        try:
+            resp = urllib2.urlopen(
+                'http://127.0.0.1:{}/api/v1/presence_weekday/10'.format(
+                    server.server_port,
+                ),
+                timeout=10,
+            )
+            self.assertEqual(json.loads(resp.read())[2], ['Tue', 30047])
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+
+
+class PresenceAnalyzerEventedTestCase(unittest.TestCase):
+    """
+    Event-loop server tests, with gevent replaced by fakes.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        utils.CACHE.clear()
+        self.local = utils.LOCAL
+        self.offloaded = []
+        self.served = []
+        self.modules = self.fake_gevent()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        for name in self.modules:
+            sys.modules.pop(name)
+        utils.LOCAL = self.local
+        utils.OFFLOAD = None
+        utils.CACHE.clear()
+
+    def fake_gevent(self):
+        """
+        Installs fake gevent modules recording served requests and
+        calls passed to the thread pool.
+        """
+        test = self
+
+        class ThreadPool(object):
+            """
+            Runs calls in threads and waits for them.
+            """
+            @staticmethod
+            def apply(func, args):
+                """
+                Records the call and runs it in a thread.
+                """
+                test.offloaded.append(args[1].__name__)
+                result = []
+                thread = threading.Thread(
+                    target=lambda: result.append(func(*args)),
+                )
+                thread.start()
+                thread.join()
+                return result[0]
+
+        class Hub(object):
+            """
+            Event loop hub with a thread pool.
+            """
+            threadpool = ThreadPool()
+
+        class WSGIServer(object):
+            """
+            Serves two requests, the dataset changes between them.
+            """
+            def __init__(self, listener, application, spawn):
+                self.application = application
+                test.served.append((listener, spawn))
+
+            def serve_forever(self):
+                """
+                Requests years listing.
+                """
+                client = self.application.test_client()
+                test.served.append(client.get('/api/v1/years').status_code)
+                utils.dataset_state()['version'] = 'changed'
+                test.served.append(json.loads(
+                    client.get('/api/v1/years').data
+                ))
+
+        modules = {
+            name: types.ModuleType(str(name))
+            for name in (
+                'gevent', 'gevent.local', 'gevent.pool', 'gevent.pywsgi',
+            )
+        }
+        modules['gevent'].get_hub = Hub
+        modules['gevent.local'].local = threading.local
+        modules['gevent.pool'].Pool = lambda size: ('pool', size)
+        modules['gevent.pywsgi'].WSGIServer = WSGIServer
+        sys.modules.update(modules)
+        return modules
+
+    def test_serve(self):
+        """
+        Test recomputing cached values in the thread pool.
+        """
+        evented.serve(main.app, '127.0.0.1', 8000, connections=50)
+        self.assertEqual(self.served, [
+            (('127.0.0.1', 8000), ('pool', 50)),
+            200,
+            ['1999', '2013', '2014'],
+        ])
+        self.assertEqual(self.offloaded, ['get_data_by_month'])
+        self.assertEqual(
+            utils.CACHE[utils.cache_key('get_rollup')]['version'], 'changed',
+        )
+
+    def test_compute(self):
+        """
+        Test passing calls to OFFLOAD with the selected dataset.
+        """
+        calls = []
+        utils.OFFLOAD = lambda func, args: calls.append(args) or func(*args)
+        self.assertEqual(utils.compute(lambda x: x + 1, 1), 2)
+        self.assertEqual(calls[0][0], utils.DEFAULT_DATASET)
+        utils.OFFLOAD = None
+        self.assertEqual(utils.compute(lambda: 3), 3)
+        self.assertEqual(len(calls), 1)
+
+
+class PresenceAnalyzerAnomaliesTestCase(unittest.TestCase):
+    """
+    Anomaly detection tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        utils.CACHE.pop('get_anomalies', None)
+
+    def test_median(self):
+        """
+        Test calculating median.
+        """
+        self.assertEqual(anomalies.median([]), 0)
+        self.assertEqual(anomalies.median([3, 1, 2]), 2)
+        self.assertEqual(anomalies.median([4, 1, 2, 3]), 2.5)
+
+    def test_detect(self):
+        """
+        Test flagging suspicious records.
+        """
+        items = {
+            datetime.date(2013, 9, day): {
+                'start': datetime.time(9, minute, 0),
+                'end': datetime.time(17, 0, 0),
+            }
+            for day, minute in [(2, 0), (9, 10), (16, 5), (23, 0)]
+        }
+        items[datetime.date(2013, 9, 30)] = {
+            'start': datetime.time(14, 0, 0),
+            'end': datetime.time(13, 0, 0),
+        }
+        items[datetime.date(2013, 9, 3)] = {
+            'start': datetime.time(5, 0, 0),
+            'end': datetime.time(22, 0, 0),
+        }
+        result = anomalies.detect(items)
+        self.assertEqual(len(result), 2)
+        self.assertEqual(result[0]['date'], '2013-09-03')
+        self.assertEqual(result[0]['reasons'], ['long_day'])
+        self.assertEqual(result[1]['date'], '2013-09-30')
+        self.assertEqual(
+            result[1]['reasons'], ['negative_interval', 'unusual_start'],
+        )
+        result = anomalies.detect(items, max_interval=86400)
+        self.assertEqual(len(result), 1)
+
+    def test_get_anomalies_cached_per_version(self):
+        """
+        Test anomalies are recomputed only when dataset changes.
+        """
+        self.assertItemsEqual(anomalies.get_anomalies().keys(), [5123])
+        utils.CACHE[utils.cache_key('get_anomalies')]['data'] = {
+            'cached': True,
+        }
+        self.assertEqual(anomalies.get_anomalies(), {'cached': True})
+        state = utils.dataset_state()
+        version = state['version']
+        state['version'] = 'changed'
+        try:
+            self.assertItemsEqual(anomalies.get_anomalies().keys(), [5123])
+        finally:
+            state['version'] = version
+
+    def test_anomalies_views(self):
+        """
+        Test listing suspicious records.
+        """
+        resp = self.client.get('/api/v1/anomalies')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data)['5123'][0], {
+            'date': '2013-09-11',
+            'start': 806,
+            'end': 58527,
+            'reasons': ['long_day'],
+        })
+        resp = self.client.get('/api/v1/anomalies/5123')
+        self.assertEqual(len(json.loads(resp.data)), 2)
+        resp = self.client.get('/api/v1/anomalies/10')
+        self.assertEqual(json.loads(resp.data), [])
+        resp = self.client.get('/api/v1/anomalies/0')
+        self.assertEqual(resp.status_code, 404)
+
+
+class PresenceAnalyzerSketchesTestCase(unittest.TestCase):
+    """
+    Start and end time distribution tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        self.client = main.app.test_client()
+
+    def test_histogram(self):
+        """
+        Test adding, removing and merging values.
+        """
+        first = sketches.Histogram(width=10)
+        for value in [5, 15, 17, 25, 86400]:
+            first.add(value)
+        self.assertEqual(first.total, 5)
+        self.assertEqual(
+            first.buckets(), [(0, 1), (10, 2), (20, 1), (86390, 1)],
+        )
+        self.assertEqual(first.quantile(0.5), 14.5)
+        self.assertEqual(first.quantile(0), 4.5)
+        first.add(86400, -1)
+        self.assertEqual(first.quantile(1), 24.5)
+
+        second = sketches.Histogram(width=10)
+        second.add(25, 3)
+        first.merge(second)
+        self.assertEqual(first.buckets(), [(0, 1), (10, 2), (20, 4)])
+        self.assertEqual(first.summary()['p90'], 24.5)
+        self.assertEqual(sketches.Histogram().quantile(0.5), 0)
+        with self.assertRaises(ValueError):
+            first.merge(sketches.Histogram(width=60))
+
+    def test_start_end_distribution(self):
+        """
+        Test merging histograms of months in a range.
+        """
+        result = utils.start_end_distribution(10)
+        self.assertEqual(result[1]['start'].buckets(), [(34740, 1)])
+        self.assertEqual(result[0]['start'].total, 0)
+        result = utils.start_end_distribution(10, since='2013-10')
+        self.assertEqual(result[1]['start'].total, 0)
+        result = utils.start_end_distribution(10, until='2013-09')
+        self.assertEqual(result[1]['end'].total, 1)
+
+    def test_presence_start_end_distribution_view(self):
+        """
+        Test percentiles of start and end times grouped by weekday.
+        """
+        resp = self.client.get('/api/v1/presence_start_end_distribution/0')
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get('/api/v1/presence_start_end_distribution/10')
+        self.assertEqual(resp.status_code, 200)
+        data = json.loads(resp.data)
+        self.assertEqual(data[1][0], 'Tue')
+        self.assertEqual(data[1][1]['start'], {
+            'median': 34769.5,
+            'p10': 34769.5,
+            'p90': 34769.5,
+            'histogram': [[34740, 1]],
+        })
+        self.assertEqual(data[0][1]['end']['histogram'], [])
+        resp = self.client.get(
+            '/api/v1/presence_start_end_distribution/10?from=2014-01',
+        )
+        self.assertEqual(json.loads(resp.data)[1][1]['start']['median'], 0)
+        resp = self.client.get(
+            '/api/v1/presence_start_end_distribution/10?from=2013-9&to=2013-9',
+        )
+        self.assertEqual(
+            json.loads(resp.data)[1][1]['start']['median'], 34769.5,
+        )
+        for query in ['from=foo', 'to=2013-13', 'from=2013-09-10']:
+            resp = self.client.get(
+                '/api/v1/presence_start_end_distribution/10?' + query,
+            )
+            self.assertEqual(resp.status_code, 400)
+
+
+class PresenceAnalyzerAggregatesTestCase(unittest.TestCase):
+    """
+    Company-wide aggregates tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        self.client = main.app.test_client()
+
+    def test_get_company_statistics(self):
+        """
+        Test aggregating presence of all users.
+        """
+        data = aggregates.get_company_statistics()
+        self.assertEqual(data['headcount'][datetime.date(2013, 9, 11)], 3)
+        self.assertEqual(len(data['headcount']), 12)
+        self.assertEqual(data['arrivals'].total, 18)
+        self.assertEqual(
+            sum(stats['days'] for stats in data['weekdays']), 18,
+        )
+
+    def test_arrival_curve(self):
+        """
+        Test cumulative fraction of arrivals.
+        """
+        arrivals = sketches.Histogram(width=3600)
+        arrivals.add(8 * 3600)
+        arrivals.add(9 * 3600, 3)
+        self.assertEqual(
+            aggregates.arrival_curve(arrivals),
+            [(28800, 0.25), (32400, 1.0)],
+        )
+        self.assertEqual(aggregates.arrival_curve(sketches.Histogram()), [])
+
+    def test_company_views(self):
+        """
+        Test company-wide endpoints.
+        """
+        resp = self.client.get('/api/v1/company/mean_time_weekday')
+        self.assertEqual(resp.status_code, 200)
+        data = json.loads(resp.data)
+        self.assertEqual(data[0], ['Mon', (24123 + 6426) / 2.0])
+        self.assertEqual(data[6], ['Sun', 22969])
+        self.assertEqual(len(data), 7)
+        resp = self.client.get('/api/v1/company/headcount')
+        data = json.loads(resp.data)
+        self.assertEqual(data[0], ['1999-09-11', 1])
+        self.assertEqual(data[-1], ['2014-09-13', 1])
+        resp = self.client.get('/api/v1/company/arrival_curve')
+        data = json.loads(resp.data)
+        self.assertEqual(data[-1][1], 1.0)
+        self.assertEqual(data[0], [0, 1 / 18.0])
+        self.assertEqual(data[1], [900, 3 / 18.0])
+
+
+class PresenceAnalyzerOccupancyTestCase(unittest.TestCase):
+    """
+    Occupancy engine tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        self.client = main.app.test_client()
+
+    def test_occupancy_curve(self):
+        """
+        Test counting people present in every slot of a day.
+        """
+        curve = occupancy.occupancy_curve(
+            [(3600, 3 * 3600), (7200, 7201), (5000, 4000)], resolution=3600,
+        )
+        self.assertEqual(len(curve), 24)
+        self.assertEqual(curve[:4], [(0, 0), (3600, 1), (7200, 2), (10800, 0)])
+        curve = occupancy.occupancy_curve([(0, 86400)], resolution=7)
+        self.assertEqual(len(curve), 12343)
+        self.assertEqual(curve[-1], (86394, 1))
+
+    def test_weekday_occupancy(self):
+        """
+        Test averaging headcount over days of a weekday.
+        """
+        curves = occupancy.weekday_occupancy(3600)
+        self.assertIs(occupancy.weekday_occupancy(3600), curves)
+        # three Thursdays: one user present at 10:00 on 2013-09-05,
+        # three on 2013-09-12 and one on 2014-09-11
+        self.assertEqual(curves[3][10], (36000, 5 / 3.0))
+        self.assertEqual(curves[2][10], (36000, 3.0))
+        self.assertEqual(curves[6][0], (0, 0))
+
+    def test_occupancy_views(self):
+        """
+        Test occupancy endpoints.
+        """
+        resp = self.client.get('/api/v1/occupancy/2013-09-11?resolution=3600')
+        self.assertEqual(resp.status_code, 200)
+        data = json.loads(resp.data)
+        self.assertEqual(data[0], [0, 1])
+        self.assertEqual(data[10], [36000, 3])
+        resp = self.client.get('/api/v1/occupancy/2013-09-11')
+        self.assertEqual(len(json.loads(resp.data)), 1440)
+        resp = self.client.get('/api/v1/occupancy/2000-01-01')
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get('/api/v1/occupancy/foo')
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get('/api/v1/occupancy/weekday?resolution=0')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get('/api/v1/occupancy/weekday?resolution=abc')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.get('/api/v1/occupancy/weekday?resolution=86400')
+        data = json.loads(resp.data)
+        self.assertEqual(data[0][0], 'Mon')
+        self.assertEqual(len(data[0][1]), 1)
+
+
+class PresenceAnalyzerExportTestCase(unittest.TestCase):
+    """
+    Raw presence records export tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        self.client = main.app.test_client()
+
+    def test_cursor(self):
+        """
+        Test encoding and decoding cursors.
+        """
+        cursor = export.encode_cursor(10, datetime.date(2013, 9, 10))
+        self.assertEqual(
+            export.decode_cursor(cursor), (10, datetime.date(2013, 9, 10)),
+        )
+        with self.assertRaises(ValueError):
+            export.decode_cursor('foo')
+
+    def test_iter_records(self):
+        """
+        Test filtering records.
+        """
+        records = list(export.iter_records())
+        self.assertEqual(len(records), 18)
+        self.assertEqual(records, sorted(records))
+        records = list(export.iter_records(
+            since=datetime.date(2013, 9, 11),
+            until=datetime.date(2013, 9, 12),
+            after=(10, datetime.date(2013, 9, 11)),
+        ))
+        self.assertEqual(
+            [(record[0], record[1].day) for record in records],
+            [(10, 12), (11, 11), (11, 12), (5123, 11), (5123, 12)],
+        )
+        self.assertEqual(list(export.iter_records(user_id=0)), [])
+
+    def test_presence_records_view(self):
+        """
+        Test paginating records with a cursor.
+        """
+        resp = self.client.get('/api/v1/presence?limit=7')
+        self.assertEqual(resp.status_code, 200)
+        page = json.loads(resp.data)
+        self.assertEqual(len(page['records']), 7)
+        self.assertEqual(page['records'][0], {
+            'user_id': 10,
+            'date': '2013-09-10',
+            'start': '09:39:05',
+            'end': '17:59:52',
+        })
+        records = page['records']
+        while page['next_cursor']:
+            resp = self.client.get(
+                '/api/v1/presence?limit=7&cursor={}'.format(
+                    page['next_cursor'],
+                ),
+            )
+            page = json.loads(resp.data)
+            records.extend(page['records'])
+        self.assertEqual(len(records), 18)
+
+        resp = self.client.get('/api/v1/presence?user_id=11&from=2013-09-12')
+        self.assertEqual(len(json.loads(resp.data)['records']), 2)
+        for query in ['limit=0', 'cursor=foo', 'from=foo', 'user_id=foo']:
+            resp = self.client.get('/api/v1/presence?{}'.format(query))
+            self.assertEqual(resp.status_code, 400)
+
+    def test_presence_export_view(self):
+        """
+        Test streaming records as NDJSON and CSV.
+        """
+        resp = self.client.get('/api/v1/presence/export?user_id=10')
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        lines = resp.data.splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['date'], '2013-09-10')
+        resp = self.client.get('/api/v1/presence/export?format=csv')
+        self.assertEqual(resp.mimetype, 'text/csv')
+        with open(TEST_DATA_CSV) as infile:
+            self.assertItemsEqual(
+                resp.data.splitlines(), infile.read().splitlines(),
+            )
+        resp = self.client.get('/api/v1/presence/export?format=xml')
+        self.assertEqual(resp.status_code, 400)
+
+
+class PresenceAnalyzerDatasetsTestCase(unittest.TestCase):
+    """
+    Multiple datasets tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.tmpdir = tempfile.mkdtemp()
+        other_csv = os.path.join(self.tmpdir, 'other.csv')
+        with open(other_csv, 'w') as outfile:
+            outfile.write('10,2013-09-10,09:00:00,17:00:00\n')
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML,
+            'DATASETS': {'other': {'DATA_CSV': other_csv}},
+        })
+        self.client = main.app.test_client()
+        utils.CACHE.clear()
+        utils.DATASET.clear()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        for name in ('DATASETS', 'DATASETS_MEMORY_BUDGET'):
+            main.app.config.pop(name, None)
+        utils.CACHE.clear()
+        utils.DATASET.clear()
+        utils.select_dataset(None)
+        shutil.rmtree(self.tmpdir)
+
+    def test_dataset_routes(self):
+        """
+        Test serving API endpoints of selected dataset.
+        """
+        resp = self.client.get('/api/v1/presence?user_id=10')
+        self.assertEqual(len(json.loads(resp.data)['records']), 3)
+        resp = self.client.get('/api/v1/datasets/other/presence?user_id=10')
+        self.assertEqual(json.loads(resp.data)['records'], [{
+            'user_id': 10,
+            'date': '2013-09-10',
+            'start': '09:00:00',
+            'end': '17:00:00',
+        }])
+        resp = self.client.get('/api/v1/datasets/other/mean_time_weekday/11')
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get('/api/v1/datasets/foo/users')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(utils.current_dataset(), utils.DEFAULT_DATASET)
+
+        resp = self.client.get('/api/v1/datasets')
+        self.assertEqual(
+            [item['name'] for item in json.loads(resp.data)],
+            ['default', 'other'],
+        )
+
+    def test_datasets_view_not_cached(self):
+        """
+        Test listing datasets reports their current state.
+        """
+        main.app.config['RESPONSE_CACHE'] = True
+        try:
+            utils.get_data()
+            resp = self.client.get('/api/v1/datasets')
+            self.assertIsNone(json.loads(resp.data)[1]['version'])
+            self.client.get('/api/v1/datasets/other/years')
+            resp = self.client.get('/api/v1/datasets')
+            other = json.loads(resp.data)[1]
+            self.assertEqual(other['name'], 'other')
+            self.assertIsNotNone(other['version'])
+            self.assertGreater(other['size'], 0)
+        finally:
+            main.app.config.pop('RESPONSE_CACHE')
+            utils.ENCODED.clear()
+
+    def test_namespaced_cache(self):
+        """
+        Test caching values of every dataset separately.
+        """
+        self.assertEqual(len(utils.get_data()), 5)
+        utils.select_dataset('other')
+        self.assertEqual(len(utils.get_data()), 1)
+        self.assertIn(('default', 'get_data'), utils.CACHE)
+        self.assertIn(('other', 'get_data'), utils.CACHE)
+        self.assertEqual(utils.dataset_state()['size'], 1024)
+
+    def test_memory_budget(self):
+        """
+        Test evicting least recently used datasets over memory budget.
+        """
+        main.app.config['DATASETS_MEMORY_BUDGET'] = 20 * 1024
+        utils.select_dataset('default')
+        utils.get_data()
+        utils.get_xml()
+        utils.select_dataset('other')
+        utils.get_data()
+        self.assertEqual(utils.enforce_memory_budget(), [])
+
+        main.app.config['DATASETS_MEMORY_BUDGET'] = 10 * 1024
+        self.assertEqual(utils.enforce_memory_budget(), ['default'])
+        self.assertEqual(
+            [key for key in utils.CACHE if key[0] == 'default'], [],
+        )
+        self.assertIn(('other', 'get_data'), utils.CACHE)
+        self.assertEqual(utils.dataset_state('default')['size'], 0)
+
+
+class PresenceAnalyzerCacheTestCase(unittest.TestCase):
+    """
+    Cache module tests.
+    """
+
+    def setUp(self):
+        """
+        Before each test, set up a environment.
+        """
+        self.settings = {}
+        self.cache = cache.Cache(self.settings)
+        main.app.config.update({
+            'DATA_CSV': TEST_DATA_CSV,
+            'DATA_XML': TEST_DATA_XML
+        })
+        utils.CACHE.clear()
+
+    def tearDown(self):
+        """
+        Get rid of unused objects after each test.
+        """
+        utils.CACHE.clear()
+
+    def test_sizeof(self):
+        """
+        Test estimating size of nested values.
+        """
+        shared = 'x' * 1000
+        size = cache.sizeof(shared)
+        self.assertGreater(cache.sizeof({1: shared}), size)
+        self.assertLess(cache.sizeof([shared, shared]), 2 * size)
+        self.assertGreater(
+            cache.sizeof(sketches.Histogram()),
+            cache.sizeof(sketches.Histogram().__dict__),
+        )
+
+    def test_fetch(self):
+        """
+        Test expiring entries and checking their versions.
+        """
+        self.assertEqual(self.cache.fetch(('a', 'f')), (None, False))
+        self.cache.store(('a', 'f'), 1, secs=600, version='v1')
+        entry, fresh = self.cache.fetch(('a', 'f'), 'v1')
+        self.assertEqual((entry['data'], fresh), (1, True))
+        self.assertFalse(self.cache.fetch(('a', 'f'), 'v2')[1])
+        self.cache.store(('a', 'g'), 2, secs=-1)
+        entry, fresh = self.cache.fetch(('a', 'g'))
+        self.assertEqual((entry['data'], fresh), (2, False))
+        self.assertEqual(self.cache.info(), {
+            'hits': 1,
+            'misses': 1,
+            'stale': 2,
+            'evictions': 0,
+            'entries': 2,
+            'bytes': 0,
+        })
+
+    def test_lru_eviction(self):
+        """
+        Test evicting least recently used entries over the limits.
+        """
+        self.settings['CACHE_MAX_ENTRIES'] = 2
+        self.cache.store(('a', 'f'), 1)
+        self.cache.store(('a', 'g'), 2)
+        self.cache.fetch(('a', 'f'))
+        self.cache.store(('a', 'h'), 3)
+        self.assertEqual(self.cache.keys(), [('a', 'f'), ('a', 'h')])
+
+        self.settings.update({
+            'CACHE_MAX_ENTRIES': None,
+            'CACHE_MAX_BYTES': cache.sizeof('x' * 1000) * 2,
+        })
+        self.cache.clear()
+        for name in 'fgh':
+            self.cache.store(('a', name), name * 1000)
+        self.assertEqual(self.cache.keys(), [('a', 'g'), ('a', 'h')])
+        self.assertEqual(self.cache.size, self.settings['CACHE_MAX_BYTES'])
+        self.assertEqual(self.cache.stats['evictions'], 2)
+
+    def test_invalidate(self):
+        """
+        Test removing entries of a namespace.
+        """
+        self.cache.store(('a', 'f'), 1)
+        self.cache.store(('a', 'g', (1,)), 2)
+        self.cache.store(('b', 'f'), 3)
+        self.assertEqual(self.cache.invalidate('a', 'g'), 1)
+        self.assertEqual(self.cache.invalidate('a'), 1)
+        self.assertEqual(self.cache.keys(), [('b', 'f')])
+
+    def test_pin(self):
+        """
+        Test making entries never expire.
+        """
+        self.cache.store(('a', 'f'), 1, secs=-1)
+        self.cache.store(('b', 'f'), 2, secs=-1)
+        self.assertEqual(self.cache.pin('a'), 1)
+        self.assertEqual(self.cache.fetch(('a', 'f'))[1], True)
+        self.assertEqual(self.cache.fetch(('b', 'f'))[1], False)
+
+    def test_memoize_arguments(self):
+        """
+        Test caching values per arguments and dataset version.
+        """
+        calls = []
+
+        @utils.memoize(versioned=True)
+        def square(value):
+            """
+            Squares a value.
+            """
+            calls.append(value)
+            return value * value
+
+        self.assertEqual(square(2), 4)
+        self.assertEqual(square(3), 9)
+        self.assertEqual(square(2), 4)
+        self.assertEqual(calls, [2, 3])
+        self.assertIn(utils.cache_key('square', args=(2,)), utils.CACHE)
+
+        state = utils.dataset_state()
+        version = state['version']
+        state['version'] = 'changed'
+        try:
+            self.assertEqual(square(2), 4)
+        finally:
+            state['version'] = version
+        self.assertEqual(calls, [2, 3, 2])
+
+    def test_get_monthly_data_cached(self):
+        """
+        Test caching monthly data per year and month.
+        """
+        data = utils.get_monthly_data('2013', '09')
+        self.assertIs(utils.get_monthly_data('2013', '09'), data)
+        self.assertIn(
+            utils.cache_key('get_monthly_data', args=('2013', '09')),
+            utils.CACHE,
+        )
+
+    def test_not_evictable(self):
+        """
+        Test entries which are not evictable are neither sized nor evicted.
+        """
+        self.settings.update({'CACHE_MAX_ENTRIES': 2, 'CACHE_MAX_BYTES': 1})
+        self.cache.store(('a', 'f'), 'x' * 1000, evictable=False)
+        self.assertEqual(self.cache.size, 0)
+        for name in 'ghi':
+            self.cache.store(('a', name), name)
+        self.assertEqual(self.cache.keys(), [('a', 'f'), ('a', 'i')])
+
+    def test_get_rollup_versioned(self):
+        """
+        Test the rollup cube is rebuilt when dataset version changes
+        and is kept out of the byte budget.
+        """
+        main.app.config['CACHE_MAX_BYTES'] = 1
+        try:
+            cube = utils.get_rollup()
+            self.assertIs(utils.get_rollup(), cube)
+            entry = utils.CACHE[utils.cache_key('get_rollup')]
+            self.assertEqual(entry['version'], utils.dataset_version())
+            self.assertEqual(entry['size'], 0)
+            self.assertIn(utils.cache_key('get_data'), utils.CACHE)
+            utils.dataset_state()['version'] = 'changed'
+            entry['expire'] = None
+            utils.CACHE[utils.cache_key('get_data')]['expire'] = None
+            self.assertIsNot(utils.get_rollup(), cube)
+        finally:
+            main.app.config.pop('CACHE_MAX_BYTES')
+            utils.DATASET.clear()
+
+    def test_response_cache_limit(self):
+        """
+        Test limiting number of encoded responses.
+        """
+        main.app.config.update({
+            'RESPONSE_CACHE': True,
+            'RESPONSE_CACHE_MAX_ENTRIES': 2,
+        })
+        utils.ENCODED.clear()
+        try:
+            utils.get_data()
+            utils.get_xml()
+            client = main.app.test_client()
+            for user_id in (10, 11, 10, 12):
+                client.get('/api/v1/presence_weekday/{}'.format(user_id))
+            self.assertEqual(
+                [key[2] for key in utils.ENCODED.keys()],
+                ['/api/v1/presence_weekday/10?',
+                 '/api/v1/presence_weekday/12?'],
+            )
+        finally:
+            for name in ('RESPONSE_CACHE', 'RESPONSE_CACHE_MAX_ENTRIES'):
+                main.app.config.pop(name)
+            utils.ENCODED.clear()
+
+
 def suite():
     """
     Default test suite.
@@ -334,6 +2385,22 @@ def suite():
     base_suite = unittest.TestSuite()
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerViewsTestCase))
     base_suite.addTest(unittest.makeSuite(PresenceAnalyzerUtilsTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerPrecomputeTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerStorageTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerIngestTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerBenchmarkTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerMetricsTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerProfilingTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerStartupTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerPreforkTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerEventedTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerAnomaliesTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerSketchesTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerAggregatesTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerOccupancyTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerExportTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerDatasetsTestCase))
+    base_suite.addTest(unittest.makeSuite(PresenceAnalyzerCacheTestCase))
     return base_suite
 
 
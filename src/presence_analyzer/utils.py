@@ -3,68 +3,402 @@
 Helper functions used in views.
 """
 
-import csv
+import hashlib
 import logging
 import threading
+import time
 
-from datetime import datetime, timedelta
-from flask import Response
-from functools import wraps
+from flask import Response, request
+from functools import partial, wraps
 from json import dumps
-from lxml import etree
 
+import metrics
+from cache import Cache
 from main import app
+from sketches import Histogram
+from storage import (
+    CSVStorage,
+    SQLiteStorage,
+    file_version,
+    group_rows,
+    new_report,
+)
 
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
-CACHE = {}
+DEFAULT_DATASET = 'default'
 
+CACHE = Cache(app.config)
+DATASET = {}
+DATASETS_LOCK = threading.Lock()
+ENCODED = Cache(app.config, prefix='RESPONSE_CACHE_')
+LOCAL = threading.local()
+OFFLOAD = None
+OFFLOADED = threading.local()
+REFRESHING = set()
+REFRESH_LOCK = threading.Lock()
+STORAGES = {}
+STORAGES_LOCK = threading.Lock()
 
-def memoize(secs=600):
+
+def datasets():
+    """
+    Returns sorted names of served datasets.
+
+    Default dataset uses top level config, others are defined in DATASETS
+    config option as dicts overriding DATA_CSV, DATA_XML, STORAGE and
+    DATA_SQLITE options.
+    """
+    return sorted(set(app.config.get('DATASETS', {})) | {DEFAULT_DATASET})
+
+
+def current_dataset():
+    """
+    Returns name of the dataset selected in the current thread.
+    """
+    return getattr(LOCAL, 'dataset', None) or DEFAULT_DATASET
+
+
+def select_dataset(name):
+    """
+    Selects dataset used by the current thread and marks it as recently
+    used. None resets the selection to the default dataset.
+    """
+    LOCAL.dataset = name
+    if name is None:
+        return
+    state = dataset_state()
+    with DATASETS_LOCK:
+        state['used'] = time.time()
+
+
+def dataset_config(key):
+    """
+    Returns config option of the current dataset.
+    """
+    overrides = app.config.get('DATASETS', {}).get(current_dataset(), {})
+    if key in overrides:
+        return overrides[key]
+    return app.config[key]
+
+
+def dataset_state(name=None):
+    """
+    Returns state of given (or current) dataset.
+
+    It creates structure like this:
+    state = {
+        'version': '5a1b6cf3e2a40-1f4',
+        'users': '5a1b6cf3e2a40-8d2',
+        'size': 18432,
+        'used': 1380000000.0,
+        'report': {
+            'policy': 'last',
+            'accepted': 18,
+            'rejected': 1,
+            'duplicates': 0,
+            'rejected_lines': [1],
+        },
+    }
     """
-    Caches values of a function and stores them for a given period of time.
+    name = name or current_dataset()
+    with DATASETS_LOCK:
+        if name not in DATASET:
+            DATASET[name] = {
+                'version': None,
+                'users': None,
+                'size': 0,
+                'used': 0,
+                'report': None,
+            }
+        return DATASET[name]
+
+
+def cache_key(fname, dataset=None, args=()):
+    """
+    Returns key of a function value in CACHE, namespaced by dataset.
+    """
+    key = (dataset or current_dataset(), fname)
+    if args:
+        key += (args,)
+    return key
+
+
+def evict_dataset(name):
+    """
+    Drops cached data and encoded responses of given dataset.
+    """
+    CACHE.invalidate(name)
+    ENCODED.invalidate(name)
+    state = dataset_state(name)
+    with DATASETS_LOCK:
+        state.update({'version': None, 'users': None, 'size': 0})
+    metrics.inc('presence_dataset_evictions_total', dataset=name)
+    log.info('Evicted dataset %s', name)
+
+
+def enforce_memory_budget():
+    """
+    Evicts least recently used datasets until estimated size of loaded
+    ones fits in DATASETS_MEMORY_BUDGET bytes. The current dataset is
+    never evicted. Returns names of evicted datasets.
+
+    Raw rows and the rollup cube are accounted only here, they are kept
+    out of CACHE_MAX_BYTES budget of the cache.
+    """
+    budget = app.config.get('DATASETS_MEMORY_BUDGET')
+    if not budget:
+        return []
+    with DATASETS_LOCK:
+        loaded = sorted(
+            (state['used'], name, state['size'])
+            for name, state in DATASET.iteritems()
+            if state['size']
+        )
+    total = sum(size for _, _, size in loaded)
+    evicted = []
+    for _, name, size in loaded:
+        if total <= budget:
+            break
+        if name == current_dataset():
+            continue
+        evict_dataset(name)
+        evicted.append(name)
+        total -= size
+    return evicted
+
+
+def compute(func, *args):
+    """
+    Calls a function computing a cached value.
+
+    When OFFLOAD is set, like apply() of a thread pool by the event-loop
+    server, the call is passed to it together with the selected dataset,
+    so it runs in a worker thread while the caller waits. Nested calls
+    made by the worker run directly.
+    """
+    if OFFLOAD is None or getattr(OFFLOADED, 'active', False):
+        return func(*args)
+    return OFFLOAD(_offloaded, (current_dataset(), func, args))
+
+
+def _offloaded(dataset, func, args):
+    """
+    Calls a function in a worker thread with given dataset selected.
+    """
+    LOCAL.dataset = dataset
+    OFFLOADED.active = True
+    try:
+        return func(*args)
+    finally:
+        OFFLOADED.active = False
+
+
+def _refresh(key, func, secs, evictable=True):
+    """
+    Recomputes cached value of a function and stores it in cache.
+    """
+    LOCAL.dataset = key[0]
+    try:
+        CACHE.store(key, func(), secs, evictable=evictable)
+    except Exception:  # pylint: disable=broad-except
+        log.exception('Background refresh of %s failed', key)
+    finally:
+        with REFRESH_LOCK:
+            REFRESHING.discard(key)
+
+
+def refresh_in_background(key, func, secs, evictable=True):
+    """
+    Starts recomputing cached value of a function in a worker thread,
+    unless it is already being recomputed. Returns the thread or None.
+    """
+    with REFRESH_LOCK:
+        if key in REFRESHING:
+            return None
+        REFRESHING.add(key)
+    thread = threading.Thread(
+        target=_refresh,
+        args=(key, func, secs, evictable),
+        name='refresh-{}-{}'.format(*key),
+    )
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def memoize(secs=600, versioned=False, evictable=True):
+    """
+    Caches values of a function per dataset and arguments and stores them
+    for a given period of time (forever if secs is None).
+
+    With versioned enabled values are also recomputed when the loaded
+    dataset changes. With CACHE_BACKGROUND_REFRESH enabled expired value
+    of an unversioned function is still returned while a fresh one is
+    computed in a worker thread, so only the very first call blocks.
+    Other values are computed with compute().
+    Values which are not evictable are kept until their dataset is
+    evicted, see enforce_memory_budget().
     """
     def decorator(func):
-        def wrapped_func():
+        fname = func.__name__  # Stores function name
+
+        @wraps(func)
+        def wrapped_func(*args):
             """
             Returns data if cache didn't expire, else gets fresh one.
             """
-            lock = threading.Lock()
-            with lock:
-                current_time = datetime.now()
-                fname = func.__name__  # Stores function name
-                if fname in CACHE and current_time <= CACHE[fname]['expire']:
-                    return CACHE[fname]['data']
-                CACHE[fname] = {
-                    'expire': current_time + timedelta(seconds=secs),
-                    'data': func(),
-                }
-                return CACHE[fname]['data']
+            key = cache_key(fname, args=args)
+            entry, fresh = CACHE.fetch(
+                key, dataset_version() if versioned else None,
+            )
+            if fresh:
+                metrics.inc('presence_cache_hits_total', function=fname)
+                return entry['data']
+            metrics.inc(
+                'presence_cache_refreshes_total'
+                if entry is not None else 'presence_cache_misses_total',
+                function=fname,
+            )
+            if entry is not None and not versioned and app.config.get(
+                    'CACHE_BACKGROUND_REFRESH'):
+                refresh_in_background(
+                    key, partial(func, *args), secs, evictable,
+                )
+                return entry['data']
+            data = compute(func, *args)
+            return CACHE.store(
+                key,
+                data,
+                secs,
+                dataset_version() if versioned else None,
+                evictable,
+            )
         return wrapped_func
     return decorator
 
 
+def memoize_per_version(func=None, evictable=True):
+    """
+    Caches value of a function until the loaded dataset changes.
+
+    Can be used with arguments, like @memoize_per_version(evictable=False).
+    """
+    if func is None:
+        return partial(memoize_per_version, evictable=evictable)
+    cached = memoize(secs=None, versioned=True, evictable=evictable)(func)
+
+    @wraps(func)
+    def wrapped_func(*args):
+        """
+        Returns cached data if dataset version didn't change.
+        """
+        get_data()  # loads dataset, so its version is known
+        return cached(*args)
+    return wrapped_func
+
+
+def inputs_version():
+    """
+    Returns versions of the presence data and users file of the current
+    dataset, which API responses are computed from.
+    """
+    state = dataset_state()
+    return state['version'], state['users']
+
+
 def jsonify(function):
     """
     Creates a response with the JSON representation of wrapped function result.
+
+    With RESPONSE_CACHE enabled encoded bodies of GET requests are kept
+    in ENCODED cache until the loaded dataset or users file changes and
+    reused by the next requests. Bodies of requests during which data
+    was reloaded are not kept, as they could mix both versions. Size
+    of the cache is limited by RESPONSE_CACHE_MAX_ENTRIES and
+    RESPONSE_CACHE_MAX_BYTES.
     """
     @wraps(function)
     def inner(*args, **kwargs):
         """
         This docstring will be overridden by @wraps decorator.
         """
-        return Response(
-            dumps(function(*args, **kwargs)),
-            mimetype='application/json'
-        )
+        key = None
+        if request.method == 'GET' and app.config.get('RESPONSE_CACHE'):
+            key = (current_dataset(), function.__name__, request.full_path)
+            version = inputs_version()
+            entry, fresh = ENCODED.fetch(key, version)
+            if fresh:
+                metrics.inc('presence_response_cache_hits_total')
+                return Response(entry['data'], mimetype='application/json')
+        result = function(*args, **kwargs)
+        with metrics.timed(
+                'presence_serialization_seconds', endpoint=function.__name__):
+            body = dumps(result)
+        if key is not None and version[0] is not None and (
+                inputs_version() == version):
+            ENCODED.store(key, body, version=version)
+        return Response(body, mimetype='application/json')
     return inner
 
 
-@memoize()
+def revalidate(function):
+    """
+    Lets clients keep responses and revalidate them with ETag.
+
+    ETag is built from versions of the data held in memory, which the
+    response is computed from, so unchanged responses are answered with
+    304 status without being computed. When data is not loaded yet or
+    is reloaded during the request, ETag is a hash of the body.
+    """
+    @wraps(function)
+    def inner(*args, **kwargs):
+        """
+        This docstring will be overridden by @wraps decorator.
+        """
+        version = inputs_version()
+        if version[0] is not None and _version_etag(version) in \
+                request.if_none_match:
+            return _not_modified(_version_etag(version))
+        response = function(*args, **kwargs)
+        if version[0] is not None and inputs_version() == version:
+            etag = _version_etag(version)
+        else:
+            etag = hashlib.sha1(response.get_data()).hexdigest()
+            if etag in request.if_none_match:
+                return _not_modified(etag)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return inner
+
+
+def _version_etag(version):
+    """
+    Returns ETag of the requested URL for given versions of data.
+    """
+    return hashlib.sha1(
+        '{}:{}:{}'.format(request.full_path, *version)
+    ).hexdigest()
+
+
+def _not_modified(etag):
+    """
+    Returns 304 response with given ETag.
+    """
+    metrics.inc('presence_not_modified_total')
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@memoize(versioned=True)
 def get_data_by_month():
     """
     Gets data for common users in DATA_CSV file and USERS.xml.
 
+    It is a projection of the rollup cube, so raw rows are not read again.
     It creates structure like this:
     data = {
         '2011': {
@@ -93,46 +427,227 @@ def get_data_by_month():
     """
     data = {}
     xml_data = get_xml()
-    users_list = xml_data.keys()
-    with open(app.config['DATA_CSV'], 'r') as csvfile:
-        presence_reader = csv.reader(csvfile, delimiter=',')
-        for i, row in enumerate(presence_reader):
-            if len(row) != 4:
-                # ignore header and footer lines
+    for year, months in get_rollup().iteritems():
+        for month, users in months.iteritems():
+            for user_id, stats in users.iteritems():
+                user_id = str(user_id)
+                if user_id not in xml_data:
+                    continue
+                data.setdefault(year, {}).setdefault(month, {})[user_id] = {
+                    'worked_hours': stats['worked_seconds'] / 3600.0,
+                    'avatar_url': xml_data[user_id]['avatar_url'],
+                }
+    return data
+
+
+def _empty_rollup_stats():
+    """
+    Returns zeroed counters of a single rollup cell.
+    """
+    return {
+        'worked_seconds': 0,
+        'days': 0,
+        'start_seconds': 0,
+        'end_seconds': 0,
+    }
+
+
+def rollup_period(date):
+    """
+    Returns (year, month) keys of the rollup cube for a date.
+    """
+    return str(date.year), '{:02.0f}'.format(date.month)
+
+
+def copy_rollup_cell(stats):
+    """
+    Returns a copy of a rollup cell which can be updated without
+    changing the original one.
+    """
+    return dict(
+        stats,
+        weekdays=[
+            dict(
+                weekday,
+                start_sketch=weekday['start_sketch'].copy(),
+                end_sketch=weekday['end_sketch'].copy(),
+            )
+            for weekday in stats['weekdays']
+        ],
+    )
+
+
+def update_rollup(cube, user_id, date, start, end, sign=1):
+    """
+    Adds a single presence entry to the rollup cube in place.
+
+    Only sums, counts and histograms are kept, so cells can be updated
+    incrementally as new rows arrive. Means are derived on read by
+    rollup_means(), percentiles by start_end_distribution().
+    Pass sign=-1 to remove a previously added entry.
+    """
+    year, month = rollup_period(date)
+    users = cube.setdefault(year, {}).setdefault(month, {})
+    if user_id not in users:
+        width = app.config.get('SKETCH_BUCKET_SECONDS', 60)
+        users[user_id] = _empty_rollup_stats()
+        users[user_id]['weekdays'] = [
+            dict(
+                _empty_rollup_stats(),
+                start_sketch=Histogram(width),
+                end_sketch=Histogram(width),
+            )
+            for _ in range(7)
+        ]
+    user_stats = users[user_id]
+    weekday_stats = user_stats['weekdays'][date.weekday()]
+    start_seconds = seconds_since_midnight(start)
+    end_seconds = seconds_since_midnight(end)
+    for stats in (user_stats, weekday_stats):
+        stats['worked_seconds'] += sign * (end_seconds - start_seconds)
+        stats['days'] += sign
+        stats['start_seconds'] += sign * start_seconds
+        stats['end_seconds'] += sign * end_seconds
+    weekday_stats['start_sketch'].add(start_seconds, sign)
+    weekday_stats['end_sketch'].add(end_seconds, sign)
+
+
+def rollup_means(stats):
+    """
+    Returns mean start and end time (in seconds since midnight)
+    of a rollup cell. Returns zeros for empty cells.
+    """
+    if not stats['days']:
+        return 0, 0
+    days = float(stats['days'])
+    return stats['start_seconds'] / days, stats['end_seconds'] / days
+
+
+def start_end_distribution(user_id, since=None, until=None):
+    """
+    Merges start and end time histograms of given user per weekday
+    from months between since and until ('YYYY-MM', both inclusive).
+
+    It creates a structure like this:
+    result = [
+        {
+            'start': <Histogram width=60 total=3>,
+            'end': <Histogram width=60 total=3>,
+        },
+        ...
+    ]
+    """
+    width = app.config.get('SKETCH_BUCKET_SECONDS', 60)
+    result = [
+        {'start': Histogram(width), 'end': Histogram(width)}
+        for _ in range(7)
+    ]
+    for year, months in get_rollup().iteritems():
+        for month, users in months.iteritems():
+            key = '{}-{}'.format(year, month)
+            if since and key < since or until and key > until:
                 continue
+            if user_id not in users:
+                continue
+            for weekday, stats in enumerate(users[user_id]['weekdays']):
+                result[weekday]['start'].merge(stats['start_sketch'])
+                result[weekday]['end'].merge(stats['end_sketch'])
+    return result
 
-            try:
-                user_id = str(row[0])
-                date = datetime.strptime(row[1], '%Y-%m-%d').date()
-                start = datetime.strptime(row[2], '%H:%M:%S').time()
-                end = datetime.strptime(row[3], '%H:%M:%S').time()
-            except (ValueError, TypeError):
-                log.debug('Problem with line %d: ', i, exc_info=True)
-            else:
-                year = str(date.year)
-                month = '{:02.0f}'.format(date.month)
-                worked_time = interval(start, end) / 3600.0
-                if user_id in users_list:
-                    if year not in data:
-                        data[year] = {}
-                    if month not in data[year]:
-                        data[year][month] = {}
-                    if user_id not in data[year][month]:
-                        data[year][month][user_id] = {
-                            'worked_hours': 0,
-                            'avatar_url': xml_data[user_id]['avatar_url']
-                        }
-                    data[year][month][user_id]['worked_hours'] += worked_time
-    return data
+
+def user_weekday_rollup(user_id):
+    """
+    Sums rollup cells of given user per weekday over all months.
+
+    It creates a structure like this:
+    result = [
+        {
+            'worked_seconds': 78217,
+            'days': 3,
+            'start_seconds': 107263,
+            'end_seconds': 185480,
+        },
+        ...
+    ]
+    """
+    result = [_empty_rollup_stats() for _ in range(7)]
+    for months in get_rollup().itervalues():
+        for users in months.itervalues():
+            if user_id not in users:
+                continue
+            for weekday, stats in enumerate(users[user_id]['weekdays']):
+                for name in result[weekday]:
+                    result[weekday][name] += stats[name]
+    return result
+
+
+@memoize_per_version(evictable=False)
+def get_rollup():
+    """
+    Pre-aggregates presence data by year, month and user in one pass.
+
+    Cube is rebuilt whenever the dataset version changes, or replaced
+    by ingest with a copy holding updated cells.
+
+    It creates structure like this:
+    data = {
+        '2013': {
+            '09': {
+                10: {
+                    'worked_seconds': 78217,
+                    'days': 3,
+                    'start_seconds': 107263,
+                    'end_seconds': 185480,
+                    'weekdays': [
+                        {
+                            'worked_seconds': 0,
+                            'days': 0,
+                            'start_seconds': 0,
+                            'end_seconds': 0,
+                            'start_sketch': <Histogram width=60 total=0>,
+                            'end_sketch': <Histogram width=60 total=0>,
+                        },
+                        ...
+                    ],
+                },
+            },
+        },
+    }
+    """
+    cube = {}
+    for user_id, items in get_data().iteritems():
+        for date, item in items.iteritems():
+            update_rollup(cube, user_id, date, item['start'], item['end'])
+    return cube
 
 
+@memoize(versioned=True)
 def get_monthly_data(year, month):
     """
     Returns data from given year and month.
+
+    Indexed storage computes monthly totals itself, otherwise they are
+    taken from the rollup cube.
     """
-    data = get_data_by_month()
     xml_data = get_xml()
-    monthly_data = data[year][month]
+    storage = get_storage()
+    if storage.indexed:
+        if not (year.isdigit() and month.isdigit()):
+            raise KeyError((year, month))
+        monthly_data = {
+            str(user_id): {
+                'worked_hours': seconds / 3600.0,
+                'avatar_url': xml_data[str(user_id)]['avatar_url'],
+            }
+            for user_id, seconds in storage.month_totals(
+                int(year), int(month),
+            ).iteritems()
+            if str(user_id) in xml_data
+        }
+        if not monthly_data:
+            raise KeyError((year, month))
+    else:
+        monthly_data = get_data_by_month()[year][month]
     result = {
         xml_data[x]['name']: monthly_data[x]
         for x in monthly_data.keys()
@@ -140,10 +655,88 @@ def get_monthly_data(year, month):
     return result
 
 
-@memoize()
+def get_storage():
+    """
+    Returns storage backend selected by STORAGE config option.
+
+    Supported backends are 'csv' (default), which scans DATA_CSV file,
+    and 'sqlite', which keeps data in indexed DATA_SQLITE database.
+    Empty database is bulk-loaded from DATA_CSV file.
+    """
+    try:
+        kind = dataset_config('STORAGE')
+    except KeyError:
+        kind = 'csv'
+    if kind == 'csv':
+        key = (kind, dataset_config('DATA_CSV'))
+    elif kind == 'sqlite':
+        key = (kind, dataset_config('DATA_SQLITE'))
+    else:
+        raise ValueError('Unknown storage: {}'.format(kind))
+    with STORAGES_LOCK:
+        if key not in STORAGES:
+            if kind == 'sqlite':
+                storage = SQLiteStorage(key[1])
+                if storage.is_empty():
+                    policy = duplicate_policy()
+                    report = new_report(policy)
+                    storage.load_csv(
+                        dataset_config('DATA_CSV'),
+                        policy=policy,
+                        report=report,
+                    )
+                    dataset_state()['report'] = report
+            else:
+                storage = CSVStorage(key[1])
+            STORAGES[key] = storage
+        return STORAGES[key]
+
+
+def get_user_data(user_id):
+    """
+    Returns presence data of a single user in get_data() format.
+
+    Indexed storage is queried directly, so whole dataset
+    does not have to be loaded.
+    """
+    storage = get_storage()
+    if not storage.indexed:
+        return get_data().get(user_id, {})
+    return {
+        date: {'start': start, 'end': end}
+        for _, date, start, end in storage.user_rows(user_id)
+    }
+
+
+def get_entry(user_id, date):
+    """
+    Returns presence entry of a user on given date in get_data() format,
+    or None if there is none.
+
+    Indexed storage looks it up with (user_id, date) index, so whole
+    dataset does not have to be loaded.
+    """
+    storage = get_storage()
+    if not storage.indexed:
+        return get_data().get(user_id, {}).get(date)
+    row = storage.entry(user_id, date)
+    if row is None:
+        return None
+    return {'start': row[2], 'end': row[3]}
+
+
+@memoize(evictable=False)
 def get_data():
     """
-    Extracts presence data from CSV file and groups it by user_id.
+    Extracts presence data of the current dataset and groups it by user_id.
+
+    Repeated user and date are resolved with DUPLICATE_POLICY and summary
+    of the load is kept in dataset state.
+
+    Estimated size of the loaded dataset (DATASET_ROW_BYTES per row,
+    rollup cube included) is recorded, and least recently used datasets
+    are evicted if they no longer fit in the memory budget. Raw rows are
+    not evicted from cache on their own.
 
     It creates structure like this:
     data = {
@@ -159,25 +752,50 @@ def get_data():
         }
     }
     """
-    data = {}
-    with open(app.config['DATA_CSV'], 'r') as csvfile:
-        presence_reader = csv.reader(csvfile, delimiter=',')
-        for i, row in enumerate(presence_reader):
-            if len(row) != 4:
-                # ignore header and footer lines
-                continue
+    storage = get_storage()
+    version = storage.version()
+    policy = duplicate_policy()
+    report = new_report(policy)
+    with metrics.timed('presence_parse_seconds', loader='get_data'):
+        data = group_rows(storage.numbered_rows(report), policy, report)
+    rows = report['accepted']
+    metrics.inc('presence_rows_parsed_total', rows, loader='get_data')
+    state = dataset_state()
+    with DATASETS_LOCK:
+        if not storage.indexed:
+            state['report'] = report
+        state['version'] = version
+        state['size'] = rows * app.config.get('DATASET_ROW_BYTES', 1024)
+    enforce_memory_budget()
+    return data
+
 
-            try:
-                user_id = int(row[0])
-                date = datetime.strptime(row[1], '%Y-%m-%d').date()
-                start = datetime.strptime(row[2], '%H:%M:%S').time()
-                end = datetime.strptime(row[3], '%H:%M:%S').time()
-            except (ValueError, TypeError):
-                log.debug('Problem with line %d: ', i, exc_info=True)
+def served_version():
+    """
+    Returns version of the presence data and users file of the current
+    dataset held in memory, or None if the dataset is not loaded.
+    Versions are built from the files, so they are the same in every
+    process which loaded the same data.
+    """
+    version, users = inputs_version()
+    if version is None:
+        return None
+    return '{}:{}'.format(version, users or '')
 
-            data.setdefault(user_id, {})[date] = {'start': start, 'end': end}
 
-    return data
+def duplicate_policy():
+    """
+    Returns policy resolving rows with repeated user and date.
+    """
+    return app.config.get('DUPLICATE_POLICY', 'last')
+
+
+def dataset_version():
+    """
+    Returns version of the dataset loaded by get_data() and updated
+    by ingest, or None if it is not loaded yet.
+    """
+    return dataset_state()['version']
 
 
 @memoize()
@@ -197,7 +815,11 @@ def get_xml():
         },
     ]
     """
-    with open(app.config['DATA_XML'], 'r') as xmlfile:
+    from lxml import etree  # deferred, lxml is slow to import
+    path = dataset_config('DATA_XML')
+    dataset_state()['users'] = file_version(path)
+    with open(path, 'r') as xmlfile, metrics.timed(
+            'presence_parse_seconds', loader='get_xml'):
         tree = etree.parse(xmlfile)
         server = tree.find('server')
         host = server.find('host').text
@@ -4,29 +4,152 @@ Defines views.
 """
 
 import calendar
+import hashlib
+import hmac
 import locale
 import logging
 import operator
+import time
 
-from flask import abort, redirect
-from flask_mako import render_template, TemplateError
-from mako.exceptions import TopLevelLookupException
+from datetime import datetime
+from itertools import islice
+from flask import (
+    Response,
+    abort,
+    g,
+    redirect,
+    request,
+    stream_with_context,
+)
+from json import dumps
 
+import helpers  # pylint: disable=unused-import
+import metrics
+from aggregates import arrival_curve, get_company_statistics
+from anomalies import get_anomalies
+from export import (
+    csv_lines,
+    decode_cursor,
+    encode_cursor,
+    iter_records,
+    ndjson_lines,
+    record_to_dict,
+)
+from ingest import ingest, parse_csv_lines, parse_ndjson_lines
 from main import app
+from occupancy import (
+    get_intervals_by_date,
+    occupancy_curve,
+    weekday_occupancy,
+)
+from startup import init_templates, readiness
 from utils import (
+    DEFAULT_DATASET,
+    dataset_state,
+    datasets,
     get_data,
     get_data_by_month,
     get_monthly_data,
+    get_storage,
+    get_user_data,
     get_xml,
     group_by_weekday,
     jsonify,
     mean,
+    memoize,
+    revalidate,
+    rollup_means,
+    select_dataset,
+    served_version,
+    start_end_distribution,
     start_end_time,
+    user_weekday_rollup,
 )
 
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
-locale.setlocale(locale.LC_COLLATE, 'pl_PL.UTF-8')
+COLLATION = {'locale': 'pl_PL.UTF-8', 'set': False}
+RENDERED = {}
+
+
+def strcoll(first, second):
+    """
+    Compares strings using Polish collation.
+
+    Locale is set on first use instead of at import time.
+    """
+    if not COLLATION['set']:
+        locale.setlocale(locale.LC_COLLATE, COLLATION['locale'])
+        COLLATION['set'] = True
+    return locale.strcoll(first, second)
+
+
+@app.url_value_preprocessor
+def pull_dataset(endpoint, values):  # pylint: disable=unused-argument
+    """
+    Selects dataset given in the URL, or the default one.
+    """
+    name = (values or {}).pop('dataset', DEFAULT_DATASET)
+    if name not in datasets():
+        abort(404)
+    select_dataset(name)
+
+
+@app.teardown_request
+def reset_dataset(exc):  # pylint: disable=unused-argument
+    """
+    Resets dataset selection after the request.
+    """
+    select_dataset(None)
+
+
+@app.before_request
+def start_timer():
+    """
+    Remembers when request started, for latency metrics.
+    """
+    if metrics.enabled():
+        g.request_started = time.time()
+
+
+@app.after_request
+def record_latency(response):
+    """
+    Records request latency per endpoint.
+    """
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        metrics.observe(
+            'presence_request_seconds',
+            time.time() - started,
+            endpoint=request.endpoint,
+            status=response.status_code,
+        )
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_view():
+    """
+    Exposes collected metrics in Prometheus text format.
+    """
+    if not metrics.enabled():
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/health/ready', methods=['GET'])
+def ready_view():
+    """
+    Reports readiness and dataset version. Responds with 503 status
+    until the worker finished its startup preparation.
+    """
+    status = readiness()
+    return Response(
+        dumps(status),
+        status=200 if status['ready'] else 503,
+        mimetype='application/json',
+    )
 
 
 @app.route('/')
@@ -50,13 +173,29 @@ def favicon():
 def render_templates(template_name):
     """
     Render .html file to view.
+
+    Pages depend only on templates and static files, which change only
+    on deploy, so with TEMPLATE_CACHE enabled every page is rendered
+    once and revalidated by browsers with ETag.
     """
     if not template_name.endswith('.html'):
         template_name = '{}.html'.format(template_name)
-    try:
-        return render_template(template_name, name=template_name)
-    except (TemplateError, TopLevelLookupException):
-        abort(404)
+    body = RENDERED.get(template_name)
+    if body is None:
+        # deferred, so API workers never import mako
+        from flask_mako import render_template, TemplateError
+        from mako.exceptions import TopLevelLookupException
+        init_templates()
+        try:
+            body = render_template(template_name, name=template_name)
+        except (TemplateError, TopLevelLookupException):
+            abort(404)
+        if app.config.get('TEMPLATE_CACHE'):
+            RENDERED[template_name] = body
+    response = Response(body, mimetype='text/html')
+    response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 
 @app.route('/api/v1/years', methods=['GET'])
@@ -94,11 +233,25 @@ def users_view():
     result = sorted(
         data.items(),
         key=lambda x: x[1]['name'],
-        cmp=locale.strcoll,
+        cmp=strcoll,
     )
     return result
 
 
+@memoize(versioned=True)
+def ranking(year, month):
+    """
+    Returns users in given year-month sorted by worked_hours.
+
+    Raises KeyError if there is no data for given year-month.
+    """
+    return sorted(
+        get_monthly_data(year, month).items(),
+        key=lambda x: operator.getitem(x[1], 'worked_hours'),
+        reverse=True,
+    )
+
+
 @app.route('/api/v1/top_employees/<string:year>/<string:month>/', methods=['GET'])
 @jsonify
 def top_employees_by_month_view(year, month):
@@ -106,15 +259,9 @@ def top_employees_by_month_view(year, month):
     Returns a dict of users in given year-month sorted by worked_hours.
     """
     try:
-        data = get_monthly_data(year, month)
+        return ranking(year, month)
     except KeyError:
         abort(404)
-    else:
-        return sorted(
-            data.items(),
-            key=lambda x: operator.getitem(x[1], 'worked_hours'),
-            reverse=True,
-        )
 
 
 @app.route('/api/v1/mean_time_weekday/<int:user_id>', methods=['GET'])
@@ -123,12 +270,18 @@ def mean_time_weekday_view(user_id):
     """
     Returns mean presence time of given user grouped by weekday.
     """
-    data = get_data()
-    if user_id not in data:
+    stats = user_statistics(user_id)
+    if stats is None:
         log.debug('User %s not found!', user_id)
         abort(404)
+    return stats['mean_time_weekday']
 
-    weekdays = group_by_weekday(data[user_id])
+
+def mean_time_weekday(data):
+    """
+    Groups mean presence time of user data by weekday.
+    """
+    weekdays = group_by_weekday(data)
     result = [
         (calendar.day_abbr[weekday], mean(intervals))
         for weekday, intervals in enumerate(weekdays)
@@ -142,12 +295,18 @@ def presence_weekday_view(user_id):
     """
     Returns total presence time of given user grouped by weekday.
     """
-    data = get_data()
-    if user_id not in data:
+    stats = user_statistics(user_id)
+    if stats is None:
         log.debug('User %s not found!', user_id)
         abort(404)
+    return stats['presence_weekday']
 
-    weekdays = group_by_weekday(data[user_id])
+
+def presence_weekday(data):
+    """
+    Groups total presence time of user data by weekday.
+    """
+    weekdays = group_by_weekday(data)
     result = [
         (calendar.day_abbr[weekday], sum(intervals))
         for weekday, intervals in enumerate(weekdays)
@@ -164,12 +323,29 @@ def presence_start_end(user_id):
     Returns average start-end presence time of
     given user grouped by weekday.
     """
-    data = get_data()
-    if user_id not in data:
+    stats = user_statistics(user_id)
+    if stats is None:
         log.debug('User %s not found!', user_id)
         abort(404)
+    return stats['presence_start_end']
+
 
-    scratch = start_end_time(data[user_id])
+def rollup_start_end(user_id):
+    """
+    Groups average start and end time of given user by weekday using
+    sums kept in the rollup cube, so presence entries are not scanned.
+    """
+    return [
+        (calendar.day_abbr[weekday],) + rollup_means(stats)
+        for weekday, stats in enumerate(user_weekday_rollup(user_id))
+    ]
+
+
+def mean_start_end(data):
+    """
+    Groups average start and end time of user data by weekday.
+    """
+    scratch = start_end_time(data)
     result = [
         (
             calendar.day_abbr[day],
@@ -179,3 +355,400 @@ def presence_start_end(user_id):
         for day, intervals in scratch.items()
     ]
     return result
+
+
+@memoize(versioned=True)
+def user_statistics(user_id):
+    """
+    Returns all presence statistics of given user or None if there is
+    no data of the user.
+    """
+    data = get_user_data(user_id)
+    if not data:
+        return None
+    if get_storage().indexed:
+        # rollup cube would need the whole dataset loaded
+        start_end = mean_start_end(data)
+    else:
+        start_end = rollup_start_end(user_id)
+    return {
+        'mean_time_weekday': mean_time_weekday(data),
+        'presence_weekday': presence_weekday(data),
+        'presence_start_end': start_end,
+    }
+
+
+@app.route('/api/v1/bundle/top_employees', methods=['GET'])
+@revalidate
+@jsonify
+def top_employees_bundle_view():
+    """
+    Returns years, months and top 'top' (5 by default) employees
+    of every month in one response.
+
+    It creates structure like this:
+    result = {
+        'version': '53a2e456978c0-258:53a2e4569a1d2-8d2',
+        'years': {
+            '2013': {
+                'months': [['09', 'September']],
+                'top': {
+                    '09': [['Jacek K.', {...}], ...],
+                },
+            },
+        },
+    }
+    """
+    top = request.args.get('top', 5, type=int)
+    if not 1 <= top <= app.config.get('BUNDLE_MAX_TOP', 100):
+        abort(400)
+    years = {}
+    for year, months in get_data_by_month().iteritems():
+        years[year] = {
+            'months': [
+                (month, calendar.month_name[int(month)])
+                for month in sorted(months)
+            ],
+            'top': {
+                month: ranking(year, month)[:top]
+                for month in months
+            },
+        }
+    return {'version': served_version(), 'years': years}
+
+
+@app.route('/api/v1/bundle/user/<int:user_id>', methods=['GET'])
+@revalidate
+@jsonify
+def user_bundle_view(user_id):
+    """
+    Returns all presence statistics of given user in one response.
+    """
+    stats = user_statistics(user_id)
+    if stats is None:
+        log.debug('User %s not found!', user_id)
+        abort(404)
+    return dict(stats, version=served_version())
+
+
+@app.route('/api/v1/ingest', methods=['POST'])
+@jsonify
+def ingest_view():
+    """
+    Appends presence rows streamed as CSV or newline delimited JSON.
+
+    Requires 'Authorization: Token <INGEST_TOKEN>' header. Endpoint is
+    disabled when INGEST_TOKEN is not configured.
+    """
+    token = app.config.get('INGEST_TOKEN')
+    if not token:
+        abort(404)
+    expected = u'Token {}'.format(token).encode('utf-8')
+    supplied = request.headers.get('Authorization', '')
+    if isinstance(supplied, unicode):
+        # werkzeug decodes header values as latin-1, restore raw bytes
+        supplied = supplied.encode('latin-1', 'replace')
+    if not hmac.compare_digest(supplied, expected):
+        abort(401)
+
+    if request.mimetype == 'text/csv':
+        parsed_lines = parse_csv_lines(request.stream)
+    elif request.mimetype == 'application/x-ndjson':
+        parsed_lines = parse_ndjson_lines(request.stream)
+    else:
+        abort(415)
+    return ingest(parsed_lines)
+
+
+@app.route('/api/v1/load_report', methods=['GET'])
+@jsonify
+def load_report_view():
+    """
+    Returns summary of the last load of the dataset from CSV file:
+    duplicate policy, numbers of accepted, rejected and duplicated rows
+    and line numbers of first rejected ones.
+    """
+    get_data()
+    report = dataset_state()['report']
+    if report is None:
+        log.debug('Dataset was not loaded from CSV file!')
+        abort(404)
+    return report
+
+
+@app.route('/api/v1/anomalies', methods=['GET'])
+@jsonify
+def anomalies_view():
+    """
+    Returns suspicious presence records of all users.
+    """
+    return get_anomalies()
+
+
+@app.route('/api/v1/anomalies/<int:user_id>', methods=['GET'])
+@jsonify
+def user_anomalies_view(user_id):
+    """
+    Returns suspicious presence records of given user.
+    """
+    data = get_anomalies()
+    if user_id in data:
+        return data[user_id]
+    if not get_user_data(user_id):
+        log.debug('User %s not found!', user_id)
+        abort(404)
+    return []
+
+
+@app.route(
+    '/api/v1/presence_start_end_distribution/<int:user_id>',
+    methods=['GET'],
+)
+@jsonify
+def presence_start_end_distribution_view(user_id):
+    """
+    Returns median, 10th and 90th percentile and histogram of start and
+    end times of given user grouped by weekday.
+
+    Optional 'from' and 'to' arguments ('YYYY-MM') limit months taken
+    into account, malformed ones are answered with 400 status.
+    """
+    if not get_user_data(user_id):
+        log.debug('User %s not found!', user_id)
+        abort(404)
+
+    distribution = start_end_distribution(
+        user_id,
+        since=_parse_month_arg('from'),
+        until=_parse_month_arg('to'),
+    )
+    return [
+        (
+            calendar.day_abbr[weekday],
+            {
+                'start': sketches['start'].summary(),
+                'end': sketches['end'].summary(),
+            },
+        )
+        for weekday, sketches in enumerate(distribution)
+    ]
+
+
+@app.route('/api/v1/company/mean_time_weekday', methods=['GET'])
+@jsonify
+def company_mean_time_weekday_view():
+    """
+    Returns mean presence time of all users grouped by weekday.
+    """
+    weekdays = get_company_statistics()['weekdays']
+    return [
+        (
+            calendar.day_abbr[weekday],
+            float(stats['total']) / stats['days'] if stats['days'] else 0,
+        )
+        for weekday, stats in enumerate(weekdays)
+    ]
+
+
+@app.route('/api/v1/company/headcount', methods=['GET'])
+@jsonify
+def company_headcount_view():
+    """
+    Returns number of present users for every day, sorted by date.
+    """
+    headcount = get_company_statistics()['headcount']
+    return [
+        (date.isoformat(), count)
+        for date, count in sorted(headcount.items())
+    ]
+
+
+@app.route('/api/v1/company/arrival_curve', methods=['GET'])
+@jsonify
+def company_arrival_curve_view():
+    """
+    Returns fraction of all arrivals which happened before the end
+    of each time bucket.
+    """
+    return arrival_curve(get_company_statistics()['arrivals'])
+
+
+def _resolution():
+    """
+    Returns 'resolution' argument in seconds, 60 by default.
+    Aborts with 400 status if it is not a number between 1 and 86400.
+    """
+    resolution = request.args.get('resolution', '60')
+    if not resolution.isdigit() or not 1 <= int(resolution) <= 86400:
+        abort(400)
+    return int(resolution)
+
+
+@app.route('/api/v1/occupancy/weekday', methods=['GET'])
+@jsonify
+def weekday_occupancy_view():
+    """
+    Returns average number of present users in every slot of a day
+    grouped by weekday. Slot length is given by 'resolution' argument.
+    """
+    curves = weekday_occupancy(_resolution())
+    return [
+        (calendar.day_abbr[weekday], curve)
+        for weekday, curve in enumerate(curves)
+    ]
+
+
+@app.route('/api/v1/occupancy/<string:date>', methods=['GET'])
+@jsonify
+def daily_occupancy_view(date):
+    """
+    Returns number of present users in every slot of given day
+    (YYYY-MM-DD). Slot length is given by 'resolution' argument.
+    """
+    try:
+        day = datetime.strptime(date, '%Y-%m-%d').date()
+    except ValueError:
+        abort(404)
+    intervals = get_intervals_by_date().get(day)
+    if intervals is None:
+        abort(404)
+    return occupancy_curve(intervals, _resolution())
+
+
+def _parse_date_arg(name):
+    """
+    Returns date ('YYYY-MM-DD') given in request argument or None.
+    Aborts with 400 status if it is malformed.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        abort(400)
+
+
+def _parse_month_arg(name):
+    """
+    Returns month ('YYYY-MM') given in request argument, normalized to
+    keys of the rollup cube, or None. Aborts with 400 status if it is
+    malformed.
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        month = datetime.strptime(value, '%Y-%m')
+    except ValueError:
+        abort(400)
+    return '{:04d}-{:02d}'.format(month.year, month.month)
+
+
+def _records_filters():
+    """
+    Returns user_id, from and to filters of raw records endpoints.
+    """
+    user_id = request.args.get('user_id')
+    if user_id is not None:
+        if not user_id.isdigit():
+            abort(400)
+        user_id = int(user_id)
+    return user_id, _parse_date_arg('from'), _parse_date_arg('to')
+
+
+@app.route('/api/v1/presence', methods=['GET'])
+@jsonify
+def presence_records_view():
+    """
+    Returns a page of raw presence records ordered by user and date.
+
+    Records can be filtered with 'user_id', 'from' and 'to' arguments.
+    Page size is given by 'limit' (100 by default). Next page is
+    requested with 'cursor' set to 'next_cursor' of the previous one,
+    which is null on the last page.
+    """
+    user_id, since, until = _records_filters()
+    limit = request.args.get('limit', 100, type=int)
+    if not 1 <= limit <= app.config.get('EXPORT_MAX_LIMIT', 1000):
+        abort(400)
+    after = None
+    if 'cursor' in request.args:
+        try:
+            after = decode_cursor(request.args['cursor'])
+        except ValueError:
+            abort(400)
+
+    records = list(islice(
+        iter_records(user_id, since, until, after), limit + 1,
+    ))
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        next_cursor = encode_cursor(*records[-1][:2])
+    return {
+        'records': [record_to_dict(record) for record in records],
+        'next_cursor': next_cursor,
+    }
+
+
+@app.route('/api/v1/presence/export', methods=['GET'])
+def presence_export_view():
+    """
+    Streams raw presence records as newline delimited JSON or CSV
+    ('format' argument), so the whole export is never held in memory.
+
+    Accepts the same filters as /api/v1/presence.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if export_format == 'ndjson':
+        lines, mimetype = ndjson_lines, 'application/x-ndjson'
+    elif export_format == 'csv':
+        lines, mimetype = csv_lines, 'text/csv'
+    else:
+        abort(400)
+    user_id, since, until = _records_filters()
+    return Response(
+        stream_with_context(lines(iter_records(user_id, since, until))),
+        mimetype=mimetype,
+    )
+
+
+@app.route('/api/v1/datasets', methods=['GET'])
+def datasets_view():
+    """
+    Lists served datasets with versions and estimated sizes of loaded ones.
+
+    It reports state of every dataset, so it is never kept in ENCODED
+    cache, which is keyed by versions of a single dataset.
+    """
+    result = []
+    for name in datasets():
+        state = dataset_state(name)
+        result.append({
+            'name': name,
+            'version': state['version'],
+            'size': state['size'],
+        })
+    return Response(dumps(result), mimetype='application/json')
+
+
+def add_dataset_rules():
+    """
+    Serves every API endpoint also under /api/v1/datasets/<dataset>/
+    prefix, e.g. /api/v1/datasets/krakow/users.
+    """
+    prefix = '/api/v1/'
+    for rule in list(app.url_map.iter_rules()):
+        if not rule.rule.startswith(prefix) or 'dataset' in rule.arguments:
+            continue
+        if rule.endpoint == 'datasets_view':
+            continue
+        app.add_url_rule(
+            '{}datasets/<dataset>/{}'.format(prefix, rule.rule[len(prefix):]),
+            rule.endpoint,
+            methods=rule.methods,
+        )
+
+
+add_dataset_rules()